@@ -1,2 +1,18 @@
 from numpy_matrix import *
 from numpy_image import *
+from numpy_domain_pool import *
+from numpy_encoder import *
+from numpy_parallel import *
+from numpy_classify import *
+from numpy_kdtree import *
+from numpy_fft_search import *
+from numpy_codes import *
+from numpy_archive import *
+from numpy_pgm import *
+from numpy_decoder import *
+from numpy_sparse import *
+from numpy_schedule import *
+from numpy_convergence import *
+from numpy_quadtree import *
+from numpy_lattice import *
+from numpy_pyramid import *
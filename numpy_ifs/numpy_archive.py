@@ -0,0 +1,343 @@
+""" entropy coded archival ifs file functionality of ifs """
+import numpy_ifs
+
+ARCHIVED_IFS_MAGIC = "IFSA"
+ARCHIVED_IFS_VERSION = 1
+
+CODER_BITS = 32
+CODER_FULL = (1 << CODER_BITS) - 1
+CODER_HALF = 1 << (CODER_BITS - 1)
+CODER_QUARTER = 1 << (CODER_BITS - 2)
+# frequency totals stay well inside the coder's precision, though large alphabets are allowed four counts per symbol
+MODEL_LIMIT = 1 << 16
+# deltas are coded as their bit length, then a sign bit and the bits below the leading one
+MAX_DELTA_BITS = 32
+
+
+class BadArchivedIFSError(Exception):
+    """ error class for archived ifs files """
+
+    def __str__(self):
+        return "Malformed archived ifs file!"
+
+
+class AdaptiveModel(object):
+    """ symbol frequencies that adapt as symbols are coded, with cumulative counts kept in a fenwick tree """
+
+    def __init__(self, num_symbols, increment=24):
+        self.num_symbols = num_symbols
+        self.increment = increment
+        self.frequencies = [1] * num_symbols
+        # halving can never take the total below one count per symbol, so the limit must leave room above that
+        self.limit = max(MODEL_LIMIT, num_symbols << 2)
+        self.rebuild()
+
+    def rebuild(self):
+        """ rebuild the fenwick tree from the frequencies """
+        self.tree = [0] * (self.num_symbols + 1)
+        for (symbol, frequency) in enumerate(self.frequencies):
+            self.add_to_tree(symbol, frequency)
+        self.total = sum(self.frequencies)
+
+    def add_to_tree(self, symbol, amount):
+        """ add to the count of a symbol in the fenwick tree """
+        position = symbol + 1
+        while position <= self.num_symbols:
+            self.tree[position] += amount
+            position += position & -position
+
+    def cumulative(self, symbol):
+        """ return the total frequency of all symbols before a given one """
+        total = 0
+        position = symbol
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def interval(self, symbol):
+        """ return the (low, high) cumulative frequencies of a symbol """
+        low = self.cumulative(symbol)
+        return (low, low + self.frequencies[symbol])
+
+    def find(self, target):
+        """ return the symbol whose interval contains a cumulative frequency """
+        position = 0
+        step = 1
+        while step * 2 <= self.num_symbols:
+            step *= 2
+        while step > 0:
+            if position + step <= self.num_symbols and self.tree[position + step] <= target:
+                position += step
+                target -= self.tree[position]
+            step /= 2
+        return position
+
+    def update(self, symbol):
+        """ make a symbol more likely, halving every frequency once the total gets too large """
+        self.frequencies[symbol] += self.increment
+        self.add_to_tree(symbol, self.increment)
+        self.total += self.increment
+        if self.total > self.limit:
+            self.frequencies = [max(1, frequency / 2) for frequency in self.frequencies]
+            self.rebuild()
+
+
+class ArithmeticEncoder(object):
+    """ integer arithmetic coder writing bits into a bytearray """
+
+    def __init__(self):
+        self.low = 0
+        self.high = CODER_FULL
+        self.pending = 0
+        self.output = bytearray()
+        self.current_byte = 0
+        self.bits_in_byte = 0
+
+    def write_bit(self, bit):
+        """ append one bit to the output """
+        self.current_byte = (self.current_byte << 1) | bit
+        self.bits_in_byte += 1
+        if self.bits_in_byte == 8:
+            self.output.append(self.current_byte)
+            self.current_byte = 0
+            self.bits_in_byte = 0
+
+    def write_bit_and_pending(self, bit):
+        """ append a bit followed by any pending opposite bits """
+        self.write_bit(bit)
+        for _ in xrange(self.pending):
+            self.write_bit(1 - bit)
+        self.pending = 0
+
+    def encode_interval(self, low, high, total):
+        """ narrow the coder to the [low, high) slice of total """
+        width = self.high - self.low + 1
+        self.high = self.low + width * high / total - 1
+        self.low = self.low + width * low / total
+        while True:
+            if self.high < CODER_HALF:
+                self.write_bit_and_pending(0)
+            elif self.low >= CODER_HALF:
+                self.write_bit_and_pending(1)
+                self.low -= CODER_HALF
+                self.high -= CODER_HALF
+            elif self.low >= CODER_QUARTER and self.high < 3 * CODER_QUARTER:
+                self.pending += 1
+                self.low -= CODER_QUARTER
+                self.high -= CODER_QUARTER
+            else:
+                break
+            self.low *= 2
+            self.high = self.high * 2 + 1
+
+    def encode(self, model, symbol):
+        """ code a symbol with an adaptive model, then update the model """
+        (low, high) = model.interval(symbol)
+        self.encode_interval(low, high, model.total)
+        model.update(symbol)
+
+    def encode_bits(self, value, num_bits):
+        """ code raw bits, most significant first """
+        for shift in xrange(num_bits - 1, -1, -1):
+            bit = (value >> shift) & 1
+            self.encode_interval(bit, bit + 1, 2)
+
+    def finish(self):
+        """ flush the coder, returning the coded bytes """
+        self.pending += 1
+        if self.low < CODER_QUARTER:
+            self.write_bit_and_pending(0)
+        else:
+            self.write_bit_and_pending(1)
+        while self.bits_in_byte != 0:
+            self.write_bit(0)
+        return bytes(self.output)
+
+
+class ArithmeticDecoder(object):
+    """ integer arithmetic decoder reading bits from a file """
+
+    def __init__(self, in_file):
+        self.in_file = in_file
+        self.current_byte = 0
+        self.bits_in_byte = 0
+        self.low = 0
+        self.high = CODER_FULL
+        self.value = 0
+        for _ in xrange(CODER_BITS):
+            self.value = (self.value << 1) | self.read_bit()
+
+    def read_bit(self):
+        """ read one bit, reading zeros past the end of the file """
+        if self.bits_in_byte == 0:
+            next_byte = self.in_file.read(1)
+            self.current_byte = ord(next_byte) if next_byte else 0
+            self.bits_in_byte = 8
+        self.bits_in_byte -= 1
+        return (self.current_byte >> self.bits_in_byte) & 1
+
+    def target(self, total):
+        """ return the cumulative frequency the coded value points at """
+        width = self.high - self.low + 1
+        return ((self.value - self.low + 1) * total - 1) / width
+
+    def decode_interval(self, low, high, total):
+        """ narrow the decoder to the [low, high) slice of total """
+        width = self.high - self.low + 1
+        self.high = self.low + width * high / total - 1
+        self.low = self.low + width * low / total
+        while True:
+            if self.high < CODER_HALF:
+                pass
+            elif self.low >= CODER_HALF:
+                self.value -= CODER_HALF
+                self.low -= CODER_HALF
+                self.high -= CODER_HALF
+            elif self.low >= CODER_QUARTER and self.high < 3 * CODER_QUARTER:
+                self.value -= CODER_QUARTER
+                self.low -= CODER_QUARTER
+                self.high -= CODER_QUARTER
+            else:
+                break
+            self.low *= 2
+            self.high = self.high * 2 + 1
+            self.value = (self.value << 1) | self.read_bit()
+
+    def decode(self, model):
+        """ decode a symbol with an adaptive model, then update the model """
+        symbol = model.find(self.target(model.total))
+        (low, high) = model.interval(symbol)
+        self.decode_interval(low, high, model.total)
+        model.update(symbol)
+        return symbol
+
+    def decode_bits(self, num_bits):
+        """ decode raw bits, most significant first """
+        value = 0
+        for _ in xrange(num_bits):
+            bit = self.target(2)
+            self.decode_interval(bit, bit + 1, 2)
+            value = (value << 1) | bit
+        return value
+
+
+class IFSArchiveModels(object):
+    """ the adaptive models for every field of an archived code, shared in form by writer and reader """
+
+    def __init__(self, contrast_bits, brightness_bits):
+        self.flats = AdaptiveModel(2)
+        self.transforms = AdaptiveModel(8)
+        self.contrasts = AdaptiveModel(1 << contrast_bits)
+        self.brightnesses = AdaptiveModel(1 << brightness_bits)
+        self.x_delta_lengths = AdaptiveModel(MAX_DELTA_BITS + 1)
+        self.y_delta_lengths = AdaptiveModel(MAX_DELTA_BITS + 1)
+
+
+def expected_domain_position(range_num, width, height, range_size, domain_size):
+    """ return the (x, y) of the domain centred on a range, which domain positions are coded relative to """
+    width_in_ranges = width / range_size
+    width_in_domains = width + 1 - domain_size
+    height_in_domains = height + 1 - domain_size
+    offset = (domain_size - range_size) / 2
+    x_coord = min(max((range_num % width_in_ranges) * range_size - offset, 0), width_in_domains - 1)
+    y_coord = min(max((range_num / width_in_ranges) * range_size - offset, 0), height_in_domains - 1)
+    return (x_coord, y_coord)
+
+
+def encode_delta(encoder, length_model, delta):
+    """ code a signed integer as its bit length, a sign bit and the bits below the leading one """
+    magnitude = abs(delta)
+    length = magnitude.bit_length()
+    encoder.encode(length_model, length)
+    if length > 0:
+        encoder.encode_bits(1 if delta < 0 else 0, 1)
+        encoder.encode_bits(magnitude - (1 << (length - 1)), length - 1)
+
+
+def decode_delta(decoder, length_model):
+    """ decode a signed integer coded by encode_delta """
+    length = decoder.decode(length_model)
+    if length == 0:
+        return 0
+    negative = decoder.decode_bits(1)
+    magnitude = (1 << (length - 1)) + decoder.decode_bits(length - 1)
+    return -magnitude if negative else magnitude
+
+
+def is_archived_ifs(filename):
+    """ check whether a file starts like an archived ifs file """
+    with open(filename, 'rb') as ifs_file:
+        return ifs_file.read(len(ARCHIVED_IFS_MAGIC)) == ARCHIVED_IFS_MAGIC
+
+
+def write_archived_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data,
+                       contrast_bits=5, brightness_bits=8, max_contrast=1.0, brightness_bounds=None):
+    """ write encoded ifs data to an entropy coded archive file, quantising contrast and brightness """
+    if brightness_bounds is None:
+        brightness_bounds = numpy_ifs.default_brightness_bounds(whiteval)
+    (min_brightness, max_brightness) = brightness_bounds
+    width_in_domains = width + 1 - domain_size
+    models = IFSArchiveModels(contrast_bits, brightness_bits)
+    encoder = ArithmeticEncoder()
+    for (range_num, (domain_num, transform_num, contrast, brightness)) in enumerate(ifs_data):
+        # a flat code is only its brightness
+        flat = domain_num == numpy_ifs.FLAT_DOMAIN
+        encoder.encode(models.flats, int(flat))
+        if flat:
+            encoder.encode(models.brightnesses, int(numpy_ifs.quantise_brightness(brightness, brightness_bits, min_brightness, max_brightness)))
+            continue
+        (expected_x, expected_y) = expected_domain_position(range_num, width, height, range_size, domain_size)
+        encode_delta(encoder, models.x_delta_lengths, domain_num % width_in_domains - expected_x)
+        encode_delta(encoder, models.y_delta_lengths, domain_num / width_in_domains - expected_y)
+        encoder.encode(models.transforms, transform_num)
+        encoder.encode(models.contrasts, int(numpy_ifs.quantise_contrast(contrast, contrast_bits, max_contrast)))
+        encoder.encode(models.brightnesses, int(numpy_ifs.quantise_brightness(brightness, brightness_bits, min_brightness, max_brightness)))
+    with open(filename, 'wb') as ifs_file:
+        ifs_file.write(numpy_ifs.BINARY_IFS_HEADER.pack(ARCHIVED_IFS_MAGIC, ARCHIVED_IFS_VERSION, contrast_bits, brightness_bits,
+                                                        width, height, range_size, domain_size, whiteval, len(ifs_data),
+                                                        max_contrast, min_brightness, max_brightness))
+        ifs_file.write(encoder.finish())
+
+
+def open_archived_ifs(filename):
+    """ read the header of an archived ifs file, returning it with a generator that decodes the codes one range at a time """
+    ifs_file = open(filename, 'rb')
+    header = ifs_file.read(numpy_ifs.BINARY_IFS_HEADER.size)
+    if len(header) != numpy_ifs.BINARY_IFS_HEADER.size:
+        ifs_file.close()
+        raise BadArchivedIFSError
+    (magic, version, contrast_bits, brightness_bits, width, height, range_size, domain_size, whiteval, num_codes,
+     max_contrast, min_brightness, max_brightness) = numpy_ifs.BINARY_IFS_HEADER.unpack(header)
+    if magic != ARCHIVED_IFS_MAGIC or version != ARCHIVED_IFS_VERSION:
+        ifs_file.close()
+        raise BadArchivedIFSError
+
+    def decode_codes():
+        """ yield each (domain, transform, contrast, brightness) in range order """
+        width_in_domains = width + 1 - domain_size
+        models = IFSArchiveModels(contrast_bits, brightness_bits)
+        try:
+            decoder = ArithmeticDecoder(ifs_file)
+            for range_num in xrange(num_codes):
+                if decoder.decode(models.flats):
+                    brightness = float(numpy_ifs.dequantise_brightness(decoder.decode(models.brightnesses), brightness_bits, min_brightness, max_brightness))
+                    yield (numpy_ifs.FLAT_DOMAIN, 0, 0.0, brightness)
+                    continue
+                (expected_x, expected_y) = expected_domain_position(range_num, width, height, range_size, domain_size)
+                x_coord = expected_x + decode_delta(decoder, models.x_delta_lengths)
+                y_coord = expected_y + decode_delta(decoder, models.y_delta_lengths)
+                transform_num = decoder.decode(models.transforms)
+                contrast = float(numpy_ifs.dequantise_contrast(decoder.decode(models.contrasts), contrast_bits, max_contrast))
+                brightness = float(numpy_ifs.dequantise_brightness(decoder.decode(models.brightnesses), brightness_bits, min_brightness, max_brightness))
+                yield (y_coord * width_in_domains + x_coord, transform_num, contrast, brightness)
+        finally:
+            ifs_file.close()
+
+    return (width, height, range_size, domain_size, whiteval, decode_codes())
+
+
+def read_archived_ifs(filename):
+    """ read ifs data from an archived ifs file """
+    (width, height, range_size, domain_size, whiteval, codes) = open_archived_ifs(filename)
+    return (width, height, range_size, domain_size, whiteval, list(codes))
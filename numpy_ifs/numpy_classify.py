@@ -0,0 +1,169 @@
+""" quadrant classification functionality of ifs """
+import itertools
+import numpy
+import numpy_ifs
+
+NUM_MAJOR_CLASSES = 3
+NUM_SUBCLASSES = 24
+
+
+def build_quadrant_orderings():
+    """ map each ordering of the four quadrants, written as a base 4 number, to its position among all 24 orderings """
+    orderings = numpy.zeros(256, dtype=int) - 1
+    for (ordering_num, ordering) in enumerate(itertools.permutations(range(4))):
+        orderings[ordering[0] * 64 + ordering[1] * 16 + ordering[2] * 4 + ordering[3]] = ordering_num
+    return orderings
+
+
+QUADRANT_ORDERINGS = build_quadrant_orderings()
+
+
+def quadrant_grids(blocks):
+    """ return the (sum, variance) of each quadrant of a stack of square blocks, as (num_blocks, 2, 2) grids """
+    blocks = numpy.asarray(blocks, dtype=numpy.float64)
+    size = blocks.shape[-1]
+    half = size / 2
+    if half == 0:
+        raise numpy_ifs.InvalidSizeError
+    # for odd sizes the middle row and column belong to no quadrant, so every transform still permutes quadrants
+    sums = numpy.empty((blocks.shape[0], 2, 2))
+    variances = numpy.empty((blocks.shape[0], 2, 2))
+    for (row, rows) in enumerate((slice(0, half), slice(size - half, size))):
+        for (column, columns) in enumerate((slice(0, half), slice(size - half, size))):
+            quadrant = blocks[:, rows, columns]
+            sums[:, row, column] = quadrant.sum((1, 2))
+            variances[:, row, column] = numpy.square(quadrant).sum((1, 2)) / float(half * half) - numpy.square(sums[:, row, column] / float(half * half))
+    return (sums, variances)
+
+
+def choose_greatest(keys, candidates):
+    """ narrow each row's candidate transforms to those whose keys are lexicographically greatest """
+    for column in xrange(keys.shape[2]):
+        values = numpy.where(candidates, keys[:, :, column], -numpy.inf)
+        candidates &= values == values.max(1)[:, numpy.newaxis]
+    return candidates
+
+
+def classify_blocks(blocks, subclasses=True):
+    """ return the (class, canonical transform) of each of a stack of square blocks """
+    # the canonical transform is the one giving the greatest quadrant sums read top left, top right, bottom left,
+    # bottom right (so the brightest quadrant ends up top left), with ties settled by quadrant variances and then
+    # by the pixels themselves, so blocks that are transforms of each other share a class and a canonical orientation
+    blocks = numpy.asarray(blocks, dtype=numpy.float64)
+    (sums, variances) = quadrant_grids(blocks)
+    num_blocks = sums.shape[0]
+    keys = numpy.empty((num_blocks, 8, 8))
+    for transform_num in xrange(8):
+        keys[:, transform_num, :4] = numpy_ifs.transform_array(transform_num, sums).reshape(num_blocks, 4)
+        keys[:, transform_num, 4:] = numpy_ifs.transform_array(transform_num, variances).reshape(num_blocks, 4)
+    candidates = choose_greatest(keys, numpy.ones((num_blocks, 8), dtype=bool))
+    tied = numpy.flatnonzero(candidates.sum(1) > 1)
+    if len(tied) > 0:
+        tied_blocks = blocks[tied]
+        block_keys = numpy.empty((len(tied), 8, tied_blocks.shape[1] * tied_blocks.shape[2]))
+        for transform_num in xrange(8):
+            block_keys[:, transform_num, :] = numpy_ifs.transform_array(transform_num, tied_blocks).reshape(len(tied), -1)
+        candidates[tied] = choose_greatest(block_keys, candidates[tied])
+    canonical_transforms = candidates.argmax(1)
+    canonical_sums = numpy.empty_like(sums)
+    canonical_variances = numpy.empty_like(variances)
+    for transform_num in xrange(8):
+        chosen = canonical_transforms == transform_num
+        canonical_sums[chosen] = numpy_ifs.transform_array(transform_num, sums[chosen])
+        canonical_variances[chosen] = numpy_ifs.transform_array(transform_num, variances[chosen])
+    # major class is where the bottom right quadrant falls in the brightness ordering of the other three
+    bottom_right = canonical_sums[:, 1, 1]
+    classes = (bottom_right > canonical_sums[:, 1, 0]).astype(int) + (bottom_right > canonical_sums[:, 0, 1]).astype(int)
+    if subclasses:
+        ordering = numpy.argsort(-canonical_variances.reshape(num_blocks, 4), axis=1, kind='mergesort')
+        ordering_nums = QUADRANT_ORDERINGS[ordering[:, 0] * 64 + ordering[:, 1] * 16 + ordering[:, 2] * 4 + ordering[:, 3]]
+        classes = classes * NUM_SUBCLASSES + ordering_nums
+    return (classes, canonical_transforms)
+
+
+def canonicalise_blocks(blocks, canonical_transforms):
+    """ apply each block's canonical transform to it """
+    blocks = numpy.asarray(blocks, dtype=numpy.float64)
+    canonical_blocks = numpy.empty_like(blocks)
+    for transform_num in xrange(8):
+        chosen = canonical_transforms == transform_num
+        canonical_blocks[chosen] = numpy_ifs.transform_array(transform_num, blocks[chosen])
+    return canonical_blocks
+
+
+def canonicalise_range(range_data):
+    """ return a square block turned to its canonical orientation, with the transform that turns it """
+    range_block = numpy.asarray(range_data, dtype=numpy.float64)
+    range_transform = int(classify_blocks(range_block[numpy.newaxis], False)[1][0])
+    return (numpy_ifs.transform_array(range_transform, range_block), range_transform)
+
+
+def relative_transform(range_transform, domain_transform):
+    """ return the transform mapping a domain onto a range, given the canonical transforms of the two """
+    # canonical range ~ canonical domain, so range ~ (range transform undone after domain transform) of the domain
+    return numpy_ifs.TRANSFORM_COMPOSITION[numpy_ifs.TRANSFORM_INVERSE[range_transform]][domain_transform]
+
+
+class IFSClassifiedPool(object):
+    """ resized domains in canonical orientation, grouped by quadrant class so a range is only compared within its class """
+
+    def __init__(self, resized_domains, subclasses=True, shared=False, quantiser=None):
+        self.quantiser = quantiser
+        resized_domains = numpy.asarray(resized_domains, dtype=numpy.float64)
+        if resized_domains.ndim != 3 or resized_domains.shape[1] != resized_domains.shape[2]:
+            raise numpy_ifs.MalformedDomainPoolError
+        self.num_domains, self.height, self.width = resized_domains.shape
+        self.length = self.height * self.width
+        self.subclasses = subclasses
+        (classes, canonical_transforms) = classify_blocks(resized_domains, subclasses)
+        # sorted by class, every class (and every major class) is a contiguous slice
+        order = numpy.argsort(classes, kind='mergesort')
+        if shared:
+            self.data = numpy_ifs.create_shared_array((self.num_domains, self.length))
+        else:
+            self.data = numpy.empty((self.num_domains, self.length))
+        self.data[:] = canonicalise_blocks(resized_domains[order], canonical_transforms[order]).reshape(self.num_domains, self.length)
+        self.domain_numbers = order
+        self.canonical_transforms = canonical_transforms[order]
+        self.classes = classes[order]
+        self.sum_vals = self.data.sum(1)
+        self.sum_sqr_vals = numpy.square(self.data).sum(1)
+        self.num_classes = NUM_MAJOR_CLASSES * NUM_SUBCLASSES if subclasses else NUM_MAJOR_CLASSES
+        self.class_starts = numpy.searchsorted(self.classes, numpy.arange(self.num_classes + 1))
+
+    def get_candidates(self, range_class):
+        """ return the slice of the pool to search for a range of a given class, widening when the class is empty """
+        (start, stop) = (self.class_starts[range_class], self.class_starts[range_class + 1])
+        if start == stop and self.subclasses:
+            major_class = range_class / NUM_SUBCLASSES
+            (start, stop) = (self.class_starts[major_class * NUM_SUBCLASSES], self.class_starts[(major_class + 1) * NUM_SUBCLASSES])
+        if start == stop:
+            (start, stop) = (0, self.num_domains)
+        return slice(start, stop)
+
+    def find_best(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ calculates best fit (domain, transform, contrast, brightness, fit) for a given range within its class, or within the class
+            of the negated range """
+        if range_matrix.length != self.length or range_matrix.width != self.width:
+            raise numpy_ifs.BadComparisonError
+        if range_sum is None:
+            range_sum = float(range_matrix.sum_vals())
+        if range_sum_sqr is None:
+            range_sum_sqr = float(range_matrix.sum_sqr_vals())
+        range_block = numpy.asarray(range_matrix.data, dtype=numpy.float64).reshape(1, self.height, self.width)
+        # a domain fitted with negative contrast has its quadrants in the opposite brightness order to the range, so it is in the
+        # class of the negated range; <range, domain> = -<negated range, domain> lets both classes be searched the same way
+        (range_classes, range_transforms) = classify_blocks(numpy.concatenate([range_block, -range_block]), self.subclasses)
+        best_code = None
+        for (sign, range_class, range_transform) in zip((1.0, -1.0), range_classes, range_transforms):
+            canonical_range = sign * numpy_ifs.transform_array(range_transform, range_block[0]).reshape(self.length)
+            candidates = self.get_candidates(range_class)
+            sum_rd = sign * self.data[candidates].dot(canonical_range)
+            (contrast, brightness, error) = numpy_ifs.solve_collage(self.length, sum_rd, self.sum_vals[candidates], self.sum_sqr_vals[candidates],
+                                                                    range_sum, range_sum_sqr, self.quantiser)
+            best = int(numpy.argmin(error))
+            if best_code is None or error[best] < best_code[4]:
+                position = candidates.start + best
+                transform_num = relative_transform(range_transform, self.canonical_transforms[position])
+                best_code = (int(self.domain_numbers[position]), transform_num, float(contrast[best]), float(brightness[best]), float(error[best]))
+        return best_code
@@ -0,0 +1,153 @@
+""" binary ifs code file functionality of ifs """
+import mmap
+import os
+import struct
+import numpy
+import numpy_ifs
+
+BINARY_IFS_MAGIC = "IFSB"
+BINARY_IFS_VERSION = 1
+# magic, version, contrast bits, brightness bits, padding, width, height, range size, domain size, whiteval,
+# number of codes, largest contrast, smallest brightness, largest brightness
+BINARY_IFS_HEADER = struct.Struct("<4sBBBxIIIIIIddd")
+TRANSFORM_BITS = 3
+# the domain record of a flat code, which has no domain
+FLAT_DOMAIN_RECORD = 0xFFFFFFFF
+
+
+class BadBinaryIFSError(Exception):
+    """ error class for binary ifs files """
+
+    def __str__(self):
+        return "Malformed binary ifs file!"
+
+
+def quantise_contrast(contrast, bits, max_contrast):
+    """ map contrasts in [-max_contrast, max_contrast] to codes 0 .. 2^bits - 2, so that zero is exact """
+    steps = (1 << bits) - 2
+    codes = numpy.rint((numpy.clip(contrast, -max_contrast, max_contrast) + max_contrast) * steps / (2.0 * max_contrast))
+    return codes.astype(numpy.int64)
+
+
+def dequantise_contrast(codes, bits, max_contrast):
+    """ map contrast codes back to contrasts """
+    steps = (1 << bits) - 2
+    return numpy.asarray(codes, dtype=numpy.float64) * (2.0 * max_contrast) / steps - max_contrast
+
+
+def quantise_brightness(brightness, bits, min_brightness, max_brightness):
+    """ map brightnesses in [min_brightness, max_brightness] to codes 0 .. 2^bits - 1 """
+    steps = (1 << bits) - 1
+    codes = numpy.rint((numpy.clip(brightness, min_brightness, max_brightness) - min_brightness) * steps / (max_brightness - min_brightness))
+    return codes.astype(numpy.int64)
+
+
+def dequantise_brightness(codes, bits, min_brightness, max_brightness):
+    """ map brightness codes back to brightnesses """
+    steps = (1 << bits) - 1
+    return numpy.asarray(codes, dtype=numpy.float64) * (max_brightness - min_brightness) / steps + min_brightness
+
+
+def default_brightness_bounds(whiteval):
+    """ brightnesses that keep any contrast in [-1, 1] able to reach every value from 0 to whiteval """
+    return (-float(whiteval), 2.0 * float(whiteval))
+
+
+class IFSQuantiser(object):
+    """ the contrast bound and bit depths that codes are stored with, so that the encoder can fit to the values stored """
+
+    def __init__(self, whiteval, contrast_bits=None, brightness_bits=None, max_contrast=1.0, brightness_bounds=None):
+        # without bit depths, values are only kept within their bounds
+        self.contrast_bits = contrast_bits
+        self.brightness_bits = brightness_bits
+        self.max_contrast = max_contrast
+        if brightness_bounds is None:
+            brightness_bounds = default_brightness_bounds(whiteval)
+        (self.min_brightness, self.max_brightness) = brightness_bounds
+
+    def snap_contrast(self, contrast):
+        """ return the contrast that would be stored for a given contrast """
+        if self.contrast_bits is None:
+            return numpy.clip(contrast, -self.max_contrast, self.max_contrast)
+        return dequantise_contrast(quantise_contrast(contrast, self.contrast_bits, self.max_contrast), self.contrast_bits, self.max_contrast)
+
+    def snap_brightness(self, brightness):
+        """ return the brightness that would be stored for a given brightness """
+        if self.brightness_bits is None:
+            return numpy.clip(brightness, self.min_brightness, self.max_brightness)
+        return dequantise_brightness(quantise_brightness(brightness, self.brightness_bits, self.min_brightness, self.max_brightness),
+                                     self.brightness_bits, self.min_brightness, self.max_brightness)
+
+
+def record_dtype(contrast_bits, brightness_bits):
+    """ the packed record for one range: domain number, then transform, contrast and brightness codes in one word """
+    if TRANSFORM_BITS + contrast_bits + brightness_bits <= 16:
+        return numpy.dtype([('domain', '<u4'), ('code', '<u2')])
+    if TRANSFORM_BITS + contrast_bits + brightness_bits <= 32:
+        return numpy.dtype([('domain', '<u4'), ('code', '<u4')])
+    raise BadBinaryIFSError
+
+
+class IFSCodeArray(object):
+    """ ifs codes read from a binary file, giving (domain, transform, contrast, brightness) tuples like a list """
+
+    def __init__(self, records, contrast_bits, brightness_bits, max_contrast, min_brightness, max_brightness):
+        codes = records['code'].astype(numpy.int64)
+        self.domains = numpy.where(records['domain'] == FLAT_DOMAIN_RECORD, numpy_ifs.FLAT_DOMAIN, records['domain'].astype(numpy.int64))
+        self.transforms = codes & ((1 << TRANSFORM_BITS) - 1)
+        self.contrasts = dequantise_contrast((codes >> TRANSFORM_BITS) & ((1 << contrast_bits) - 1), contrast_bits, max_contrast)
+        self.brightnesses = dequantise_brightness(codes >> (TRANSFORM_BITS + contrast_bits), brightness_bits, min_brightness, max_brightness)
+
+    def __len__(self):
+        return len(self.domains)
+
+    def __getitem__(self, i):
+        return (int(self.domains[i]), int(self.transforms[i]), float(self.contrasts[i]), float(self.brightnesses[i]))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+def is_binary_ifs(filename):
+    """ check whether a file starts like a binary ifs file """
+    with open(filename, 'rb') as ifs_file:
+        return ifs_file.read(len(BINARY_IFS_MAGIC)) == BINARY_IFS_MAGIC
+
+
+def write_binary_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data,
+                     contrast_bits=5, brightness_bits=8, max_contrast=1.0, brightness_bounds=None):
+    """ write encoded ifs data to a binary file, quantising contrast and brightness """
+    if brightness_bounds is None:
+        brightness_bounds = default_brightness_bounds(whiteval)
+    (min_brightness, max_brightness) = brightness_bounds
+    records = numpy.zeros(len(ifs_data), dtype=record_dtype(contrast_bits, brightness_bits))
+    if len(ifs_data) > 0:
+        (domains, transforms, contrasts, brightnesses) = [numpy.array(field) for field in zip(*ifs_data)]
+        records['domain'] = numpy.where(domains == numpy_ifs.FLAT_DOMAIN, FLAT_DOMAIN_RECORD, domains)
+        records['code'] = (transforms |
+                           (quantise_contrast(contrasts, contrast_bits, max_contrast) << TRANSFORM_BITS) |
+                           (quantise_brightness(brightnesses, brightness_bits, min_brightness, max_brightness) << (TRANSFORM_BITS + contrast_bits)))
+    with open(filename, 'wb') as ifs_file:
+        ifs_file.write(BINARY_IFS_HEADER.pack(BINARY_IFS_MAGIC, BINARY_IFS_VERSION, contrast_bits, brightness_bits,
+                                              width, height, range_size, domain_size, whiteval, len(ifs_data),
+                                              max_contrast, min_brightness, max_brightness))
+        ifs_file.write(records.tostring())
+
+
+def read_binary_ifs(filename):
+    """ read ifs data from a binary file, mapping the records straight from the file without parsing them """
+    with open(filename, 'rb') as ifs_file:
+        if os.fstat(ifs_file.fileno()).st_size < BINARY_IFS_HEADER.size:
+            raise BadBinaryIFSError
+        mapped = mmap.mmap(ifs_file.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, contrast_bits, brightness_bits, width, height, range_size, domain_size, whiteval, num_codes,
+     max_contrast, min_brightness, max_brightness) = BINARY_IFS_HEADER.unpack_from(mapped)
+    if magic != BINARY_IFS_MAGIC or version != BINARY_IFS_VERSION:
+        raise BadBinaryIFSError
+    dtype = record_dtype(contrast_bits, brightness_bits)
+    if len(mapped) != BINARY_IFS_HEADER.size + num_codes * dtype.itemsize:
+        raise BadBinaryIFSError
+    records = numpy.frombuffer(mapped, dtype=dtype, count=num_codes, offset=BINARY_IFS_HEADER.size)
+    codes = IFSCodeArray(records, contrast_bits, brightness_bits, max_contrast, min_brightness, max_brightness)
+    return (width, height, range_size, domain_size, whiteval, codes)
@@ -0,0 +1,62 @@
+""" convergence detection functionality of ifs """
+import math
+import numpy
+
+CONVERGENCE_METRICS = ('max', 'rms', 'psnr')
+
+
+class UnknownConvergenceMetricError(Exception):
+    """ error class for IFSConvergenceMonitor """
+
+    def __str__(self):
+        return "Unknown convergence metric!"
+
+
+class IFSConvergenceMonitor(object):
+    """ measures how far an image has moved since it was last checked, and whether that is within a threshold """
+
+    def __init__(self, data, whiteval, metric='max', threshold=0.5):
+        if metric not in CONVERGENCE_METRICS:
+            raise UnknownConvergenceMetricError
+        self.whiteval = whiteval
+        self.metric = metric
+        # max and rms converge once the change is at most the threshold, psnr once it is at least the threshold in db
+        self.threshold = threshold
+        # both buffers are allocated once and reused by every check
+        self.previous = numpy.array(data, dtype=numpy.float64)
+        self.difference = numpy.empty_like(self.previous)
+        self.max_change = None
+        self.rms_change = None
+        self.psnr = None
+        self.checks = 0
+
+    def __str__(self):
+        if self.checks == 0:
+            return "not yet checked"
+        return "largest change {:.3f}, rms change {:.3f}, psnr {:.2f}db".format(self.max_change, self.rms_change, self.psnr)
+
+    def check(self, data):
+        """ measure the change from the last check to the given values, returning whether it is within the threshold """
+        numpy.subtract(data, self.previous, out=self.difference)
+        numpy.absolute(self.difference, out=self.difference)
+        self.max_change = float(self.difference.max())
+        numpy.square(self.difference, out=self.difference)
+        mean_sqr_change = float(self.difference.mean())
+        self.rms_change = math.sqrt(mean_sqr_change)
+        if mean_sqr_change == 0:
+            self.psnr = float('inf')
+        else:
+            self.psnr = 10.0 * math.log10(float(self.whiteval) * self.whiteval / mean_sqr_change)
+        self.previous[...] = data
+        self.checks += 1
+        return self.converged()
+
+    def converged(self):
+        """ whether the last check was within the threshold """
+        if self.checks == 0:
+            return False
+        if self.metric == 'max':
+            return self.max_change <= self.threshold
+        if self.metric == 'rms':
+            return self.rms_change <= self.threshold
+        return self.psnr >= self.threshold
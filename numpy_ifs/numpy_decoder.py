@@ -0,0 +1,193 @@
+""" vectorised decoding functionality of ifs """
+import os
+import numpy
+import numpy_ifs
+
+
+class StaleDecodePlanError(Exception):
+    """ error class for decode plans """
+
+    def __str__(self):
+        return "Decode plan does not match the image!"
+
+
+def code_fields(ifs_data):
+    """ return the (domains, transforms, contrasts, brightnesses) of a set of ifs codes as arrays """
+    if isinstance(ifs_data, numpy_ifs.IFSCodeArray):
+        return (ifs_data.domains.astype(numpy.int64), ifs_data.transforms, ifs_data.contrasts, ifs_data.brightnesses)
+    (domains, transforms, contrasts, brightnesses) = zip(*ifs_data)
+    return (numpy.array(domains, dtype=numpy.int64), numpy.array(transforms, dtype=numpy.int64),
+            numpy.array(contrasts, dtype=numpy.float64), numpy.array(brightnesses, dtype=numpy.float64))
+
+
+def resolve_flat_codes(domains, contrasts):
+    """ return (domains, contrasts) with each flat code reading the first domain with zero contrast, which gives the same range """
+    flat = domains == numpy_ifs.FLAT_DOMAIN
+    return (numpy.where(flat, 0, domains), numpy.where(flat, 0.0, contrasts))
+
+
+class IFSDecodePlan(object):
+    """ ifs codes compiled to index tables, the pixels each new pixel averages and where it goes, with its contrast and brightness """
+
+    def __init__(self, width, height, range_size, domain_size, sources, destinations, contrasts, brightnesses, range_starts=None):
+        self.width = width
+        self.height = height
+        self.range_size = range_size
+        self.domain_size = domain_size
+        self.scaling = domain_size / range_size
+        # sources[pixel] holds the flat indices of the scaling x scaling block averaged for that pixel, row by row
+        self.sources = sources
+        self.destinations = destinations
+        self.contrasts = contrasts
+        self.brightnesses = brightnesses
+        # the rows of range i are range_starts[i]:range_starts[i + 1], which lets ranges differ in size
+        if range_starts is None:
+            range_starts = numpy.arange(len(destinations) / (range_size * range_size) + 1) * range_size * range_size
+        self.range_starts = range_starts
+        self.num_ranges = len(range_starts) - 1
+
+    @classmethod
+    def compile(cls, image, ifs_data):
+        """ fold the domain position, decimation and transform of every code into one table of source pixels """
+        if len(ifs_data) != image.num_ranges:
+            raise numpy_ifs.MalformedImageError
+        (domains, transforms, contrasts, brightnesses) = code_fields(ifs_data)
+        (domains, contrasts) = resolve_flat_codes(domains, contrasts)
+        if domains.min() < 0 or domains.max() >= image.num_domains:
+            raise numpy_ifs.OutOfArrayError("ifs codes refer to a domain outside the image!")
+        range_nums = numpy.arange(image.num_ranges)
+        return cls.compile_ranges(image, (range_nums % image.width_in_ranges) * image.range_size, (range_nums / image.width_in_ranges) * image.range_size,
+                                  numpy.repeat(image.range_size, image.num_ranges), domains % image.width_in_domains, domains / image.width_in_domains,
+                                  transforms, contrasts, brightnesses)
+
+    @classmethod
+    def compile_ranges(cls, image, range_xs, range_ys, sizes, domain_xs, domain_ys, transforms, contrasts, brightnesses):
+        """ compile ranges of any size that tile the image, each with its domain's top left corner, into a plan """
+        scaling = image.get_domain_scaling()
+        sizes = numpy.asarray(sizes, dtype=numpy.intp)
+        range_starts = numpy.zeros(len(sizes) + 1, dtype=numpy.intp)
+        range_starts[1:] = numpy.cumsum(sizes * sizes)
+        if range_starts[-1] != image.length:
+            raise numpy_ifs.MalformedImageError
+        range_offsets = numpy.asarray(range_ys) * image.width + numpy.asarray(range_xs)
+        domain_offsets = numpy.asarray(domain_ys) * image.width + numpy.asarray(domain_xs)
+        transforms = numpy.asarray(transforms)
+        sources = numpy.empty((image.length, scaling * scaling), dtype=numpy.intp)
+        destinations = numpy.empty(image.length, dtype=numpy.intp)
+        samples = numpy.arange(scaling)
+        for size in numpy.unique(sizes):
+            members = numpy.flatnonzero(sizes == size)
+            pixels = numpy.arange(size)
+            rows = range_starts[members][:, numpy.newaxis] + numpy.arange(size * size)
+            destinations[rows] = range_offsets[members][:, numpy.newaxis] + (pixels[:, numpy.newaxis] * image.width + pixels).reshape(size * size)
+            # offsets within a domain of sample (a, b) of reduced pixel (u, v), indexed [a, b, u, v] so transforms act on (u, v)
+            positions = pixels * scaling
+            block = ((samples[:, numpy.newaxis, numpy.newaxis, numpy.newaxis] + positions[numpy.newaxis, numpy.newaxis, :, numpy.newaxis]) * image.width +
+                     samples[numpy.newaxis, :, numpy.newaxis, numpy.newaxis] + positions[numpy.newaxis, numpy.newaxis, numpy.newaxis, :])
+            for transform_num in xrange(8):
+                group = members[transforms[members] == transform_num]
+                if len(group) > 0:
+                    transformed = numpy.transpose(numpy_ifs.transform_array(transform_num, block), (2, 3, 0, 1)).reshape(size * size, scaling * scaling)
+                    sources[range_starts[group][:, numpy.newaxis] + numpy.arange(size * size)] = (domain_offsets[group, numpy.newaxis, numpy.newaxis] +
+                                                                                                  transformed[numpy.newaxis])
+        return cls(image.width, image.height, image.range_size, image.domain_size, sources, destinations,
+                   numpy.repeat(numpy.asarray(contrasts, dtype=numpy.float64), sizes * sizes),
+                   numpy.repeat(numpy.asarray(brightnesses, dtype=numpy.float64), sizes * sizes), range_starts)
+
+    @classmethod
+    def load(cls, filename):
+        """ read a plan saved by save """
+        with numpy.load(filename) as saved:
+            (width, height, range_size, domain_size) = [int(value) for value in saved['geometry']]
+            return cls(width, height, range_size, domain_size, saved['sources'], saved['destinations'], saved['contrasts'], saved['brightnesses'],
+                       saved['range_starts'] if 'range_starts' in saved.files else None)
+
+    def save(self, filename):
+        """ write the plan to an npz file """
+        # numpy.savez adds .npz to names without it, so write through a file object to keep the name as given
+        with open(filename, 'wb') as plan_file:
+            numpy.savez(plan_file, geometry=numpy.array([self.width, self.height, self.range_size, self.domain_size]),
+                        sources=self.sources, destinations=self.destinations, contrasts=self.contrasts, brightnesses=self.brightnesses,
+                        range_starts=self.range_starts)
+
+    def matches(self, image):
+        """ check that the plan was compiled for an image of this shape """
+        return (self.width, self.height, self.range_size, self.domain_size) == (image.width, image.height, image.range_size, image.domain_size)
+
+    def clamp_contrasts(self, max_contrast):
+        """ limit every contrast to at most max_contrast in magnitude """
+        self.contrasts = numpy.clip(self.contrasts, -max_contrast, max_contrast)
+
+    def range_contrasts(self):
+        """ return the contrast of each range """
+        return self.contrasts[self.range_starts[:-1]]
+
+    def evaluate(self, flat_data, start=0, stop=None):
+        """ return the new values of the pixels in rows start:stop of the plan, from the given pixel values """
+        samples = flat_data[self.sources[start:stop]].reshape(-1, self.scaling, self.scaling)
+        # averaged as IFSMatrix.reduce does, along rows then down columns, so results are identical
+        return self.brightnesses[start:stop] + self.contrasts[start:stop] * samples.mean(2).mean(1)
+
+    def apply(self, image):
+        """ apply every code at once from the image as it was, returning the number of pixels that changed """
+        if not self.matches(image):
+            raise StaleDecodePlanError
+        flat_data = image.data.reshape(image.length)
+        new_values = numpy.empty_like(flat_data)
+        new_values[self.destinations] = self.evaluate(flat_data)
+        changed = numpy.count_nonzero(flat_data != new_values)
+        flat_data[...] = new_values
+        image.invalidate_tables()
+        return changed
+
+    def apply_range(self, image, start, stop=None):
+        """ apply the codes of ranges start:stop in place, returning the number of pixels that changed """
+        if not self.matches(image):
+            raise StaleDecodePlanError
+        if stop is None:
+            stop = start + 1
+        rows = slice(self.range_starts[start], self.range_starts[stop])
+        flat_data = image.data.reshape(image.length)
+        destinations = self.destinations[rows]
+        new_values = self.evaluate(flat_data, rows.start, rows.stop).astype(flat_data.dtype)
+        changed = numpy.count_nonzero(flat_data[destinations] != new_values)
+        flat_data[destinations] = new_values
+        image.invalidate_tables()
+        return changed
+
+
+def load_or_compile_plan(image, ifs_data, plan_file=None, ifs_file=None, compile_plan=None):
+    """ return a decode plan, from plan_file if it is newer than ifs_file and fits the image, else compiled by compile_plan and saved there """
+    if compile_plan is None:
+        compile_plan = IFSDecodePlan.compile
+    if plan_file is not None and os.path.exists(plan_file):
+        if ifs_file is None or os.path.getmtime(plan_file) >= os.path.getmtime(ifs_file):
+            plan = IFSDecodePlan.load(plan_file)
+            if plan.matches(image) and len(plan.destinations) == image.length:
+                return plan
+    plan = compile_plan(image, ifs_data)
+    if plan_file is not None:
+        plan.save(plan_file)
+    return plan
+
+
+class IFSDecoder(object):
+    """ decodes ifs codes a whole sweep at a time, every range updated at once from the image as it was before the sweep """
+
+    def __init__(self, image, ifs_data=None, plan=None):
+        self.image = image
+        if plan is None:
+            plan = IFSDecodePlan.compile(image, ifs_data)
+        self.plan = plan
+
+    def sweep(self):
+        """ apply every code once, returning the number of pixels that changed """
+        return self.plan.apply(self.image)
+
+    def decode(self, max_sweeps):
+        """ sweep until the image stops changing or max_sweeps is reached, yielding the number of pixels changed by each sweep """
+        for _ in xrange(max_sweeps):
+            changed = self.sweep()
+            yield changed
+            if changed == 0:
+                break
@@ -0,0 +1,85 @@
+""" batch domain search functionality of ifs """
+import numpy
+import numpy_ifs
+
+
+class MalformedDomainPoolError(Exception):
+    """ error class for IFSDomainPool """
+
+    def __str__(self):
+        return "Malformed domain pool!"
+
+
+class IFSDomainPool(object):
+    """ every resized domain under all eight transforms, held as one (num_domains * 8, length) array,
+        or only in its canonical orientation when canonical is set """
+
+    def __init__(self, resized_domains, shared=False, quantiser=None, canonical=False):
+        self.quantiser = quantiser
+        resized_domains = numpy.asarray(resized_domains, dtype=numpy.float64)
+        if resized_domains.ndim != 3 or resized_domains.shape[1] != resized_domains.shape[2]:
+            raise MalformedDomainPoolError
+        self.num_domains, self.height, self.width = resized_domains.shape
+        self.length = self.height * self.width
+        # a canonical range is compared with each canonical domain once, instead of a range with each domain eight times
+        self.canonical = canonical
+        self.orientations = 1 if canonical else 8
+        if shared:
+            stacked = numpy_ifs.create_shared_array((self.num_domains, self.orientations, self.length))
+        else:
+            stacked = numpy.empty((self.num_domains, self.orientations, self.length))
+        if canonical:
+            self.canonical_transforms = numpy_ifs.classify_blocks(resized_domains, False)[1]
+            stacked[:, 0, :] = numpy_ifs.canonicalise_blocks(resized_domains, self.canonical_transforms).reshape(self.num_domains, self.length)
+        else:
+            for transform_num in xrange(8):
+                stacked[:, transform_num, :] = numpy_ifs.transform_array(transform_num, resized_domains).reshape(self.num_domains, self.length)
+        self.data = stacked.reshape(self.num_domains * self.orientations, self.length)
+        # sums are the same under every transform, so they are kept once per domain
+        flat_domains = resized_domains.reshape(self.num_domains, self.length)
+        self.sum_vals = flat_domains.sum(1)
+        self.sum_sqr_vals = numpy.square(flat_domains).sum(1)
+
+    def solve(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ contrast, brightness and squared error of every candidate, indexed [domain_num, transform_num], or [domain_num, 0]
+            against a range already in canonical orientation when the pool is canonical """
+        if range_matrix.length != self.length or range_matrix.width != self.width:
+            raise numpy_ifs.BadComparisonError
+        if range_sum is None:
+            range_sum = float(range_matrix.sum_vals())
+        if range_sum_sqr is None:
+            range_sum_sqr = float(range_matrix.sum_sqr_vals())
+        sum_rd = self.data.dot(numpy.asarray(range_matrix.data, dtype=numpy.float64).reshape(self.length)).reshape(self.num_domains, self.orientations)
+        return solve_collage(self.length, sum_rd, self.sum_vals[:, numpy.newaxis], self.sum_sqr_vals[:, numpy.newaxis], range_sum, range_sum_sqr,
+                             self.quantiser)
+
+    def find_best(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ calculates best fit (domain, transform, contrast, brightness, fit) for a given range """
+        range_transform = 0
+        if self.canonical:
+            (canonical_data, range_transform) = numpy_ifs.canonicalise_range(range_matrix.data)
+            range_matrix = numpy_ifs.IFSMatrix(range_matrix.width, canonical_data)
+        (contrast, brightness, error) = self.solve(range_matrix, range_sum, range_sum_sqr)
+        best = int(numpy.argmin(error))
+        (domain_num, transform_num) = divmod(best, self.orientations)
+        if self.canonical:
+            transform_num = numpy_ifs.relative_transform(range_transform, self.canonical_transforms[domain_num])
+        return (domain_num, transform_num, float(contrast.flat[best]), float(brightness.flat[best]), float(error.flat[best]))
+
+
+def solve_collage(length, sum_rd, sum_d, sum_dd, range_sum, range_sum_sqr, quantiser=None):
+    """ least squares contrast, brightness and squared error for candidates given their sums against a range """
+    length = float(length)
+    divisor = length * sum_dd - sum_d * sum_d
+    safe_divisor = numpy.where(divisor == 0, 1.0, divisor)
+    contrast = numpy.where(divisor == 0, 0.0, (length * sum_rd - sum_d * range_sum) / safe_divisor)
+    # the error is quadratic in each parameter, so the nearest value that can be stored to the best contrast is the best
+    # stored contrast, and the best brightness for that contrast is refitted before it too is snapped to a stored value
+    if quantiser is not None:
+        contrast = quantiser.snap_contrast(contrast)
+    brightness = (range_sum - contrast * sum_d) / length
+    if quantiser is not None:
+        brightness = quantiser.snap_brightness(brightness)
+    error = (range_sum_sqr + contrast * contrast * sum_dd + length * brightness * brightness -
+             2.0 * contrast * sum_rd - 2.0 * brightness * range_sum + 2.0 * contrast * brightness * sum_d)
+    return (contrast, brightness, numpy.maximum(error, 0.0))
@@ -0,0 +1,225 @@
+""" encoding functionality of ifs """
+import numpy
+import numpy_ifs
+
+# the domain of a flat code, which sets its range to one brightness without reading any domain
+FLAT_DOMAIN = -1
+
+
+def is_flat_code(ifs_code):
+    """ whether a (domain, transform, contrast, brightness) code is a flat code """
+    return ifs_code[0] == FLAT_DOMAIN
+
+
+def fit_flat_code(length, range_sum, range_sum_sqr, quantiser=None):
+    """ return (domain, transform, contrast, brightness, squared error) of the flat code that best fits a range """
+    brightness = float(range_sum) / length
+    if quantiser is not None:
+        brightness = float(quantiser.snap_brightness(brightness))
+    error = float(range_sum_sqr - 2.0 * brightness * range_sum + length * brightness * brightness)
+    return (FLAT_DOMAIN, 0, 0.0, brightness, error)
+
+
+def spiral_domains(x_centre, y_centre, width_in_domains, height_in_domains, max_radius=None, step=1):
+    """ yield the numbers of the domains on a lattice ring by ring outwards from a position, each ring clockwise from its top left """
+    limit = max(x_centre, y_centre, width_in_domains - 1 - x_centre, height_in_domains - 1 - y_centre)
+    if max_radius is not None:
+        # every position is within step - 1 of a lattice domain, so going that far always yields at least one
+        limit = min(limit, max(max_radius, step - 1))
+    for radius in xrange(limit + 1):
+        (left, right, top, bottom) = (x_centre - radius, x_centre + radius, y_centre - radius, y_centre + radius)
+        if radius == 0:
+            ring = [(x_centre, y_centre)]
+        else:
+            ring = ([(x_coord, top) for x_coord in xrange(left, right + 1)] +
+                    [(right, y_coord) for y_coord in xrange(top + 1, bottom + 1)] +
+                    [(x_coord, bottom) for x_coord in xrange(right - 1, left - 1, -1)] +
+                    [(left, y_coord) for y_coord in xrange(bottom - 1, top, -1)])
+        for (x_coord, y_coord) in ring:
+            if (0 <= x_coord < width_in_domains and 0 <= y_coord < height_in_domains and
+                    x_coord % step == 0 and y_coord % step == 0):
+                yield y_coord * width_in_domains + x_coord
+
+
+class IFSEncoder(object):
+    """ finds the best ifs transform from the domains of an image to each of its ranges """
+
+    def __init__(self, image, search='full', decimate=False, shared=False, verbosity=0, candidates=8, quantiser=None, flat_threshold=None,
+                 domain_step=1, search_radius=None, fit_threshold=1.0, canonical=False):
+        self.image = image
+        self.quantiser = quantiser
+        # ranges whose standard deviation is at most flat_threshold are given flat codes without searching
+        self.flat_threshold = flat_threshold
+        self.flat_ranges = 0
+        self.search = search
+        self.decimate = decimate
+        self.verbosity = verbosity
+        # full and local searches stop at the first fit whose mean absolute error per pixel is at most fit_threshold
+        self.fit_threshold = float(image.range_size * image.range_size) * fit_threshold
+        # local searches go no further than search_radius domain positions from the range in either direction,
+        # or than domain_step - 1 if that is further, so there is always a lattice domain to compare
+        self.search_radius = search_radius
+        self.domain_area_scaling = float(image.domain_size * image.domain_size) / float(image.range_size * image.range_size)
+        self.resized_domain_array = [None] * image.num_domains
+        self.resized_domain_sums = [None] * image.num_domains
+        # full, local and batch searches compare a range with each domain once, with both turned to canonical orientation,
+        # rather than with each domain under all eight transforms
+        self.canonical = canonical
+        self.canonical_domain_array = [None] * image.num_domains
+        self.canonical_domain_transforms = [None] * image.num_domains
+        self.domain_pool = None
+        self.stats = numpy_ifs.IFSSearchStats()
+        # only domains on a lattice of this spacing are searched, except that the coarse search refines between them;
+        # pools number the lattice domains from 0, so their results are mapped back through domain_nums
+        self.domain_step = domain_step
+        self.domain_nums = numpy_ifs.lattice_domains(image.width_in_domains, image.height_in_domains, domain_step)
+        self.lattice_pool = False
+        image.build_summed_area_tables()
+        if search == 'batch':
+            self.domain_pool = numpy_ifs.IFSDomainPool(self.get_lattice_domains(), shared, quantiser, canonical)
+            self.lattice_pool = True
+        elif search == 'classified':
+            self.domain_pool = numpy_ifs.IFSClassifiedPool(self.get_lattice_domains(), shared=shared, quantiser=quantiser)
+            self.lattice_pool = True
+        elif search == 'nearest':
+            self.domain_pool = numpy_ifs.IFSNearestPool(self.get_lattice_domains(), candidates, quantiser=quantiser)
+            self.lattice_pool = True
+        elif search == 'coarse':
+            self.domain_pool = numpy_ifs.IFSLatticePool(image.get_resized_domains(decimate), image.width_in_domains, image.height_in_domains,
+                                                        domain_step, candidates, quantiser)
+        elif search == 'fft':
+            # correlation finds every domain position at once, so a lattice would save nothing and is not used
+            self.domain_pool = numpy_ifs.IFSCorrelationPool(image, quantiser)
+        elif shared:
+            # worker processes read the resized domains from shared memory rather than each resizing its own copy
+            resized_domains = numpy_ifs.create_shared_array((image.num_domains, image.range_size, image.range_size))
+            resized_domains[:] = image.get_resized_domains(decimate)
+            for domain_num in xrange(image.num_domains):
+                self.resized_domain_array[domain_num] = numpy_ifs.IFSMatrix(image.range_size, resized_domains[domain_num])
+                self.resized_domain_sums[domain_num] = (image.get_domain_sums(domain_num)[0] / self.domain_area_scaling,
+                                                        self.resized_domain_array[domain_num].sum_sqr_vals())
+
+    def get_lattice_domains(self):
+        """ return the domains on the lattice resized to range size, as one array """
+        if self.domain_step == 1:
+            return self.image.get_resized_domains(self.decimate)
+        if self.decimate:
+            return self.image.get_resized_domains(True)[self.domain_nums]
+        # resizing is done one domain at a time, so only the domains on the lattice are resized
+        return numpy.array([self.image.get_domain(domain_num).resize(self.image.range_size).data for domain_num in self.domain_nums.tolist()],
+                           dtype=numpy.float64)
+
+    def get_resized_domain(self, domain_num):
+        """ return a given domain resized to range size, with its (sum, sum of squares) """
+        if self.resized_domain_array[domain_num] is None:
+            if self.decimate:
+                self.resized_domain_array[domain_num] = self.image.get_reduced_domain(domain_num)
+            else:
+                self.resized_domain_array[domain_num] = self.image.get_domain(domain_num).resize(self.image.range_size)
+            self.resized_domain_sums[domain_num] = (self.image.get_domain_sums(domain_num)[0] / self.domain_area_scaling,
+                                                    self.resized_domain_array[domain_num].sum_sqr_vals())
+        return (self.resized_domain_array[domain_num], self.resized_domain_sums[domain_num])
+
+    def get_canonical_domain(self, domain_num):
+        """ return a given resized domain turned to its canonical orientation, with the transform that turns it """
+        if self.canonical_domain_array[domain_num] is None:
+            (canonical_data, self.canonical_domain_transforms[domain_num]) = numpy_ifs.canonicalise_range(self.get_resized_domain(domain_num)[0].data)
+            self.canonical_domain_array[domain_num] = numpy_ifs.IFSMatrix(self.image.range_size, canonical_data)
+        return (self.canonical_domain_array[domain_num], self.canonical_domain_transforms[domain_num])
+
+    def compare_domain(self, irange, range_transform, domain_num, range_sum, range_sum_sqr, best_fit):
+        """ return (transform, contrast, brightness, fit) of a domain against a range, if it can beat best_fit,
+            where a range_transform means the range is in canonical orientation and only the canonical domain is compared """
+        (resized_domain, (domain_sum, domain_sum_sqr)) = self.get_resized_domain(domain_num)
+        if range_transform is None:
+            return numpy_ifs.find_best_transform(irange, resized_domain, range_sum, domain_sum, domain_sum_sqr,
+                                                 range_sum_sqr, best_fit, self.stats, self.quantiser, fit_threshold=self.fit_threshold)
+        (canonical_domain, domain_transform) = self.get_canonical_domain(domain_num)
+        (transform, contrast, brightness, fit) = numpy_ifs.find_best_transform(irange, canonical_domain, range_sum, domain_sum, domain_sum_sqr,
+                                                                               range_sum_sqr, best_fit, self.stats, self.quantiser, (0,), self.fit_threshold)
+        if transform is not None:
+            transform = numpy_ifs.relative_transform(range_transform, domain_transform)
+        return (transform, contrast, brightness, fit)
+
+    def canonicalise_range(self, irange):
+        """ return a range and the transform turning it to canonical orientation, or the range as it is and None without canonical searches """
+        if not self.canonical:
+            return (irange, None)
+        (canonical_data, range_transform) = numpy_ifs.canonicalise_range(irange.data)
+        return (numpy_ifs.IFSMatrix(self.image.range_size, canonical_data), range_transform)
+
+    def encode_range(self, range_num):
+        """ return (domain, transform, contrast, brightness, fit) for a given range """
+        flat_code = self.encode_flat_range(range_num)
+        if flat_code is not None:
+            return flat_code
+        (range_sum, range_sum_sqr) = self.image.get_range_sums(range_num)
+        irange = self.image.get_range(range_num)
+        if self.search == 'local':
+            return self.search_local(range_num, irange, range_sum, range_sum_sqr)
+        if self.domain_pool is not None:
+            best = self.domain_pool.find_best(irange, range_sum, range_sum_sqr)
+            if self.lattice_pool and self.domain_step != 1:
+                best = (int(self.domain_nums[best[0]]),) + best[1:]
+            return best
+        return self.search_full(range_num, irange, range_sum, range_sum_sqr)
+
+    def encode_flat_range(self, range_num):
+        """ return the flat code for a range if its standard deviation is within the flat threshold, else None """
+        if self.flat_threshold is None:
+            return None
+        (range_sum, range_sum_sqr) = self.image.get_range_sums(range_num)
+        length = self.image.range_size * self.image.range_size
+        variance = float(range_sum_sqr) / length - (float(range_sum) / length) ** 2
+        if variance > self.flat_threshold * self.flat_threshold:
+            return None
+        self.flat_ranges += 1
+        return fit_flat_code(length, range_sum, range_sum_sqr, self.quantiser)
+
+    def encode_ranges(self, start=0):
+        """ yield the encoding of every range from start onwards, in range order """
+        for range_num in xrange(start, self.image.num_ranges):
+            yield self.encode_range(range_num)
+
+    def search_full(self, range_num, irange, range_sum, range_sum_sqr):
+        """ compare a range against each domain in turn, stopping at the first good enough fit """
+        image = self.image
+        best_domain = None
+        best_transform = None
+        best_contrast = None
+        best_brightness = None
+        best_fit = 9999999999
+        (irange, range_transform) = self.canonicalise_range(irange)
+        for domain_num in self.domain_nums.tolist():
+            (transform, contrast, brightness, fit) = self.compare_domain(irange, range_transform, domain_num, range_sum, range_sum_sqr, best_fit)
+            if fit < best_fit:
+                best_fit = fit
+                best_domain = domain_num
+                best_transform = transform
+                best_contrast = contrast
+                best_brightness = brightness
+            if fit <= self.fit_threshold:
+                break
+            if self.verbosity > 1:
+                if domain_num % (image.num_domains / 100) == 0:
+                    print("  done domain " + str(domain_num) +
+                          " / " + str(image.num_domains) +
+                          " (" + str((100 * domain_num) / image.num_domains) +
+                          "% of range " + str(range_num + 1) +
+                          " of " + str(image.num_ranges) + ")")
+        return (best_domain, best_transform, best_contrast, best_brightness, best_fit)
+
+    def search_local(self, range_num, irange, range_sum, range_sum_sqr):
+        """ compare a range against domains in rings outwards from it, stopping at the first good enough fit """
+        image = self.image
+        # rings are centred where the archive format expects the domain, so nearby domains are also the cheapest to store
+        (x_centre, y_centre) = numpy_ifs.expected_domain_position(range_num, image.width, image.height, image.range_size, image.domain_size)
+        best = (None, None, None, None, 9999999999)
+        (irange, range_transform) = self.canonicalise_range(irange)
+        for domain_num in spiral_domains(x_centre, y_centre, image.width_in_domains, image.height_in_domains, self.search_radius, self.domain_step):
+            (transform, contrast, brightness, fit) = self.compare_domain(irange, range_transform, domain_num, range_sum, range_sum_sqr, best[4])
+            if fit < best[4]:
+                best = (domain_num, transform, contrast, brightness, fit)
+            if fit <= self.fit_threshold:
+                break
+        return best
@@ -0,0 +1,70 @@
+""" fft correlation domain search functionality of ifs """
+import numpy
+import numpy_ifs
+
+
+class IFSCorrelationPool(object):
+    """ every domain position of an image, compared against a range all at once by fft correlation of the decimated images """
+
+    def __init__(self, image, quantiser=None):
+        self.quantiser = quantiser
+        # domain (x, y) resized to range size is the range-sized window at (x / scaling, y / scaling) of
+        # the image decimated at phase (x % scaling, y % scaling), so its inner product with a range for every
+        # position is one correlation of that decimated image, and its sums come from the decimated image's tables
+        self.scaling = image.get_domain_scaling()
+        self.range_size = image.range_size
+        self.length = image.range_size * image.range_size
+        self.height_in_domains = image.height_in_domains
+        self.width_in_domains = image.width_in_domains
+        self.num_domains = image.num_domains
+        self.phases = [(x_phase, y_phase) for y_phase in xrange(self.scaling) for x_phase in xrange(self.scaling)]
+        decimated_images = [image.get_decimated_image(x_phase, y_phase) for (x_phase, y_phase) in self.phases]
+        # padding every phase to the same shape lets all phases and transforms go through the fft together
+        self.fft_shape = (max(decimated.shape[0] for decimated in decimated_images), max(decimated.shape[1] for decimated in decimated_images))
+        padded = numpy.zeros((len(self.phases),) + self.fft_shape)
+        self.sum_vals = numpy.empty((self.height_in_domains, self.width_in_domains))
+        self.sum_sqr_vals = numpy.empty((self.height_in_domains, self.width_in_domains))
+        for (phase_num, decimated) in enumerate(decimated_images):
+            padded[phase_num, :decimated.shape[0], :decimated.shape[1]] = decimated
+            (x_phase, y_phase) = self.phases[phase_num]
+            (rows, columns) = self.get_phase_shape(x_phase, y_phase)
+            self.sum_vals[y_phase::self.scaling, x_phase::self.scaling] = numpy_ifs.summed_area_windows(
+                numpy_ifs.summed_area_table(decimated), self.range_size)[:rows, :columns]
+            self.sum_sqr_vals[y_phase::self.scaling, x_phase::self.scaling] = numpy_ifs.summed_area_windows(
+                numpy_ifs.summed_area_table(numpy.square(decimated)), self.range_size)[:rows, :columns]
+        self.spectra = numpy.fft.rfft2(padded)
+
+    def get_phase_shape(self, x_phase, y_phase):
+        """ return the (rows, columns) of domain positions at a given phase """
+        return (len(xrange(y_phase, self.height_in_domains, self.scaling)), len(xrange(x_phase, self.width_in_domains, self.scaling)))
+
+    def correlate(self, range_matrix):
+        """ inner product of a range with every domain under every transform, indexed [y, x, transform_num] """
+        # each transform correlates with one kernel
+        kernels = numpy_ifs.transformed_range_kernels(range_matrix.data)
+        kernel_spectra = numpy.conj(numpy.fft.rfft2(kernels, self.fft_shape))
+        correlations = numpy.fft.irfft2(self.spectra[:, numpy.newaxis] * kernel_spectra[numpy.newaxis], self.fft_shape)
+        sums_rd = numpy.empty((self.height_in_domains, self.width_in_domains, 8))
+        for (phase_num, (x_phase, y_phase)) in enumerate(self.phases):
+            (rows, columns) = self.get_phase_shape(x_phase, y_phase)
+            sums_rd[y_phase::self.scaling, x_phase::self.scaling] = numpy.rollaxis(correlations[phase_num, :, :rows, :columns], 0, 3)
+        return sums_rd
+
+    def solve(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ contrast, brightness and squared error of every candidate, indexed [domain_num, transform_num] """
+        if range_matrix.length != self.length or range_matrix.width != self.range_size:
+            raise numpy_ifs.BadComparisonError
+        if range_sum is None:
+            range_sum = float(range_matrix.sum_vals())
+        if range_sum_sqr is None:
+            range_sum_sqr = float(range_matrix.sum_sqr_vals())
+        sum_rd = self.correlate(range_matrix).reshape(self.num_domains, 8)
+        return numpy_ifs.solve_collage(self.length, sum_rd, self.sum_vals.reshape(self.num_domains, 1), self.sum_sqr_vals.reshape(self.num_domains, 1),
+                                       range_sum, range_sum_sqr, self.quantiser)
+
+    def find_best(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ calculates best fit (domain, transform, contrast, brightness, fit) for a given range """
+        (contrast, brightness, error) = self.solve(range_matrix, range_sum, range_sum_sqr)
+        best = int(numpy.argmin(error))
+        (domain_num, transform_num) = divmod(best, 8)
+        return (domain_num, transform_num, float(contrast.flat[best]), float(brightness.flat[best]), float(error.flat[best]))
@@ -1,6 +1,7 @@
 """ image functionality of ifs """
 import numpy_ifs
 import numpy
+from numpy.lib.stride_tricks import as_strided
 
 
 class MalformedImageError(Exception):
@@ -45,12 +46,26 @@ class NullValueError(Exception):
         return "Null value in array!"
 
 
+def summed_area_table(values):
+    """ return the integral image of a 2d array, padded with a leading row and column of zeros """
+    table = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    table[1:, 1:] = values.cumsum(0).cumsum(1)
+    return table
+
+
+def summed_area_windows(table, size):
+    """ return the sum of every square window of the given size from an integral image, indexed [y, x] """
+    return table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+
+
 class IFSImage(object):
     """ base image object for IFS """
 
     def __init__(self, width, whiteval, range_size, domain_size, data):
+        if not isinstance(data, numpy.ndarray):
+            data = numpy.array(list(data))
         self.width = width
-        self.length = len(data)
+        self.length = data.size
         self.height = self.length / self.width
         self.whiteval = whiteval
         self.range_size = range_size
@@ -69,9 +84,14 @@ class IFSImage(object):
         self.num_ranges = self.width_in_ranges * self.height_in_ranges
         self.num_domains = self.width_in_domains * self.height_in_domains
         self.ranges = [None] * self.num_ranges
-        self.domains = [None] * self.num_domains
         self.height = self.length / width
-        self.data = numpy.array(list(data)).reshape(self.height, self.width)
+        # pixels read from binary pgm files are unsigned, and would wrap around in arithmetic
+        self.data = data.astype(numpy.promote_types(data.dtype, numpy.int64)).reshape(self.height, self.width)
+        self.sum_table = None
+        self.sum_sqr_table = None
+        self.domain_pool = None
+        self.domain_pool_source = None
+        self.block_means = None
 
     # def __str__(self):
     #     r_str = ""
@@ -85,20 +105,9 @@ class IFSImage(object):
     #             r_str += str(self.data[tracker]) + ", "
     #     return r_str
 
-    def write_pgm(self, filename):
+    def write_pgm(self, filename, binary=False):
         """ write pgm """
-        with open(filename, 'w') as wfile:
-            wfile.write("P2\n")
-            wfile.write("# ifs compressor\n")
-            wfile.write(str(self.width) + " " + str(self.height) + "\n")
-            wfile.write(str(self.whiteval) + "\n")
-            for val in self.data.flatten().tolist():
-                if val < 0:
-                    wfile.write("0\n")
-                elif val > self.whiteval:
-                    wfile.write(str(self.whiteval) + "\n")
-                else:
-                    wfile.write(str(val) + "\n")
+        numpy_ifs.write_pgm(filename, self.data, self.whiteval, binary)
 
     def get_range(self, i, j=None):
         """ return a given range """
@@ -146,24 +155,112 @@ class IFSImage(object):
                 print "failed to get domain " + str(count)
                 raise e
 
+    def get_domain_pool(self):
+        """ return all domains as a read-only (height_in_domains, width_in_domains, domain_size, domain_size) view of data """
+        if self.domain_pool_source is not self.data:
+            (row_stride, column_stride) = self.data.strides
+            self.domain_pool = as_strided(self.data,
+                                          shape=(self.height_in_domains, self.width_in_domains, self.domain_size, self.domain_size),
+                                          strides=(row_stride, column_stride, row_stride, column_stride),
+                                          writeable=False)
+            self.domain_pool_source = self.data
+        return self.domain_pool
+
     def get_domain(self, i, j=None, decoding=False):
-        """ return a given domain """
+        """ return a given domain, as a view that follows later changes to the image """
+        # domains are views, so decoding always sees current values without any caching to bypass
         if j is None:
-            if i < 0 or i > self.num_domains:
-                raise OutOfArrayError("requested value " + i + " + is not in the range (0 - " + str(self.num_domains) + ")")
-            if self.domains[i] is not None and not decoding:
-                return self.domains[i]
-            else:
-                x_domain_coord = i % self.width_in_domains
-                y_domain_coord = i / self.width_in_domains
-                if not decoding:
-                    self.domains[i] = self.get_domain(x_domain_coord, y_domain_coord)
-                    return self.domains[i]
-                else:
-                    return self.get_domain(x_domain_coord, y_domain_coord)
-
+            if i < 0 or i >= self.num_domains:
+                raise OutOfArrayError("requested value " + str(i) + " + is not in the range (0 - " + str(self.num_domains) + ")")
+            x_domain_coord = i % self.width_in_domains
+            y_domain_coord = i / self.width_in_domains
+            return self.get_domain(x_domain_coord, y_domain_coord)
         else:
-            return self.get_square_submatrix(i, j, self.domain_size)
+            if i < 0 or j < 0 or i >= self.width_in_domains or j >= self.height_in_domains:
+                raise OutOfArrayError("requested a domain that overlaps the edge of image array!")
+            return numpy_ifs.IFSMatrix(self.domain_size, self.get_domain_pool()[j, i])
+
+    def build_summed_area_tables(self):
+        """ build integral images of values and squared values, padded with a leading row and column of zeros """
+        values = self.data.astype(numpy.float64)
+        self.sum_table = summed_area_table(values)
+        self.sum_sqr_table = summed_area_table(numpy.square(values))
+
+    def get_window_sums(self, x, y, size):
+        """ return (sum, sum of squares) of any square window in constant time """
+        if (size + x > self.width or size + y > self.height or x < 0 or y < 0):
+            raise OutOfArrayError("requested sums for a window that overlaps the edge of image array!")
+        if self.sum_table is None:
+            self.build_summed_area_tables()
+        window_sum = (self.sum_table[y + size, x + size] - self.sum_table[y, x + size] -
+                      self.sum_table[y + size, x] + self.sum_table[y, x])
+        window_sum_sqr = (self.sum_sqr_table[y + size, x + size] - self.sum_sqr_table[y, x + size] -
+                          self.sum_sqr_table[y + size, x] + self.sum_sqr_table[y, x])
+        return (float(window_sum), float(window_sum_sqr))
+
+    def get_all_window_sums(self, size):
+        """ return (sums, sums of squares) of every square window of the given size, indexed [y, x] """
+        if self.sum_table is None:
+            self.build_summed_area_tables()
+        return (summed_area_windows(self.sum_table, size), summed_area_windows(self.sum_sqr_table, size))
+
+    def get_range_sums(self, i):
+        """ return (sum, sum of squares) of a given range """
+        x_range_coord = i % self.width_in_ranges
+        y_range_coord = i / self.width_in_ranges
+        return self.get_window_sums(x_range_coord * self.range_size, y_range_coord * self.range_size, self.range_size)
+
+    def get_domain_sums(self, i):
+        """ return (sum, sum of squares) of a given domain """
+        x_domain_coord = i % self.width_in_domains
+        y_domain_coord = i / self.width_in_domains
+        return self.get_window_sums(x_domain_coord, y_domain_coord, self.domain_size)
+
+    def get_domain_scaling(self):
+        """ return the integer factor by which domains shrink to range size """
+        if self.domain_size % self.range_size != 0:
+            raise numpy_ifs.InvalidSizeError
+        return self.domain_size / self.range_size
+
+    def get_block_means(self):
+        """ return the mean of the scaling x scaling block at every pixel offset, computed once from the summed-area tables """
+        if self.block_means is None:
+            scaling = self.get_domain_scaling()
+            self.block_means = self.get_all_window_sums(scaling)[0] / float(scaling * scaling)
+        return self.block_means
+
+    def get_decimated_image(self, x_phase, y_phase):
+        """ return the image averaged down by domain_size / range_size, starting at a given phase offset """
+        scaling = self.get_domain_scaling()
+        return self.get_block_means()[y_phase::scaling, x_phase::scaling]
+
+    def get_reduced_domain_pool(self):
+        """ return all domains resized to range size, as a read-only view over the decimated images """
+        # domain (x, y) is the range-sized window at (x / scaling, y / scaling) of decimated image (x % scaling, y % scaling)
+        scaling = self.get_domain_scaling()
+        block_means = self.get_block_means()
+        (row_stride, column_stride) = block_means.strides
+        return as_strided(block_means,
+                          shape=(self.height_in_domains, self.width_in_domains, self.range_size, self.range_size),
+                          strides=(row_stride, column_stride, scaling * row_stride, scaling * column_stride),
+                          writeable=False)
+
+    def get_reduced_domain(self, i):
+        """ return a given domain resized to range size, read from the decimated images """
+        if i < 0 or i >= self.num_domains:
+            raise OutOfArrayError("requested value " + str(i) + " + is not in the range (0 - " + str(self.num_domains) + ")")
+        x_domain_coord = i % self.width_in_domains
+        y_domain_coord = i / self.width_in_domains
+        return numpy_ifs.IFSMatrix(self.range_size, self.get_reduced_domain_pool()[y_domain_coord, x_domain_coord])
+
+    def get_resized_domains(self, decimate=False):
+        """ return every domain resized to range size, as one (num_domains, range_size, range_size) array """
+        if decimate:
+            return self.get_reduced_domain_pool().reshape(self.num_domains, self.range_size, self.range_size)
+        resized_domains = numpy.empty((self.num_domains, self.range_size, self.range_size))
+        for (domain_num, domain) in enumerate(self.get_domains()):
+            resized_domains[domain_num] = domain.resize(self.range_size).data
+        return resized_domains
 
     def get_square_submatrix(self, x, y, size):
         """ get any square submatrix """
@@ -172,15 +269,7 @@ class IFSImage(object):
             print "requested size " + str(size) + " + y " + str(y) + " = " + str(size + y)
             print "in array matrix of width " + str(self.width) + " and height " + str(self.height)
             raise OutOfArrayError("requested a square submatrix that overlaps the edge of image array!")
-        data = [None] * (size * size)
-        for i in range(size):
-            for j in range(size):
-                received_value = self.get_value(x + i, y + j)
-                if received_value is None:
-                    raise NullValueError
-                else:
-                    data[j * size + i] = self.get_value(x + i, y + j)
-        return numpy_ifs.IFSMatrix(size, numpy.array(data).reshape(size, size))
+        return numpy_ifs.IFSMatrix(size, self.data[y:y + size, x:x + size].copy())
 
     def put_square_submatrix(self, x, y, new_matrix):
         """ put any square submatrix """
@@ -193,6 +282,12 @@ class IFSImage(object):
             for j in xrange(new_matrix.height):
                 self.set_value(new_matrix.data.item(j * new_matrix.width + i), x + i, y + j)
 
+    def invalidate_tables(self):
+        """ forget everything derived from the pixel values, after they change """
+        self.sum_table = None
+        self.sum_sqr_table = None
+        self.block_means = None
+
     def get_value(self, x, y=None):
         """ get any value """
         if y is None:
@@ -204,6 +299,7 @@ class IFSImage(object):
     def set_value(self, value, x, y=None):
         """ get any value """
         if value is not None:
+            self.invalidate_tables()
             if y is None:
                 numpy.put(self.data, x, value)
                 # self.data[x] = value
@@ -221,6 +317,10 @@ class IFSImage(object):
         # print "contrast is " + str(contrast)
         # print "brightness is " + str(brightness)
         # print "domain is " + str(self.get_domain(domain_num))
+        if domain_num == numpy_ifs.FLAT_DOMAIN:
+            # a flat code reads no domain, so there is nothing to resize or transform
+            self.put_range(numpy_ifs.IFSMatrix(self.range_size, numpy.full((self.range_size, self.range_size), brightness)), range_num)
+            return
         self.put_range(numpy_ifs.apply_transform(transform_num,
                                            self.get_domain(domain_num, decoding=True)
                                            .resize(self.range_size, self.range_size)
@@ -0,0 +1,160 @@
+""" nearest neighbour domain search functionality of ifs """
+import heapq
+import numpy
+import numpy_ifs
+
+
+class IFSKDTree(object):
+    """ k-d tree over a set of points, built and searched with numpy """
+
+    def __init__(self, points, leaf_size=32):
+        # points are reordered so that every node covers a contiguous slice of them
+        self.points = numpy.array(points, dtype=numpy.float64)
+        self.ids = numpy.arange(len(self.points))
+        self.leaf_size = leaf_size
+        self.split_dims = []
+        self.split_vals = []
+        self.children = []
+        self.bounds = []
+        self.build(0, len(self.points))
+
+    def build(self, start, stop):
+        """ build the node covering points[start:stop], returning its number """
+        node = len(self.bounds)
+        self.bounds.append((start, stop))
+        self.split_dims.append(None)
+        self.split_vals.append(None)
+        self.children.append(None)
+        if stop - start <= self.leaf_size:
+            return node
+        subset = self.points[start:stop]
+        spread = subset.max(0) - subset.min(0)
+        split_dim = int(numpy.argmax(spread))
+        if spread[split_dim] == 0:
+            return node
+        middle = (stop - start) / 2
+        order = numpy.argpartition(subset[:, split_dim], middle)
+        self.points[start:stop] = subset[order]
+        self.ids[start:stop] = self.ids[start:stop][order]
+        self.split_dims[node] = split_dim
+        self.split_vals[node] = self.points[start + middle, split_dim]
+        left = self.build(start, start + middle)
+        right = self.build(start + middle, stop)
+        self.children[node] = (left, right)
+        return node
+
+    def query(self, point, k, max_leaves=None):
+        """ return the ids of the (up to) k points nearest to a given point, nearest first """
+        # nodes are visited nearest first, so stopping after max_leaves leaves gives a good approximate answer
+        point = numpy.asarray(point, dtype=numpy.float64)
+        # max heap of the best found so far, as (-squared distance, id)
+        best = []
+        queue = [(0.0, 0)]
+        leaves_visited = 0
+        while queue:
+            (bound, node) = heapq.heappop(queue)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            if self.children[node] is None:
+                (start, stop) = self.bounds[node]
+                distances = numpy.square(self.points[start:stop] - point).sum(1)
+                if stop - start > k:
+                    nearest = numpy.argpartition(distances, k)[:k]
+                else:
+                    nearest = xrange(stop - start)
+                for position in nearest:
+                    candidate = (-distances[position], self.ids[start + position])
+                    if len(best) < k:
+                        heapq.heappush(best, candidate)
+                    elif candidate > best[0]:
+                        heapq.heapreplace(best, candidate)
+                leaves_visited += 1
+                if max_leaves is not None and leaves_visited >= max_leaves:
+                    break
+            else:
+                offset = point[self.split_dims[node]] - self.split_vals[node]
+                (left, right) = self.children[node]
+                if offset < 0:
+                    (near, far) = (left, right)
+                else:
+                    (near, far) = (right, left)
+                heapq.heappush(queue, (bound, near))
+                heapq.heappush(queue, (max(bound, offset * offset), far))
+        return [point_id for (_, point_id) in sorted(best, reverse=True)]
+
+
+def normalise_blocks(blocks):
+    """ return each block with its mean removed and scaled to unit length, and the length it had """
+    blocks = numpy.asarray(blocks, dtype=numpy.float64)
+    flat_blocks = blocks.reshape(blocks.shape[0], -1)
+    centred = flat_blocks - flat_blocks.mean(1)[:, numpy.newaxis]
+    norms = numpy.sqrt(numpy.square(centred).sum(1))
+    safe_norms = numpy.where(norms == 0, 1.0, norms)
+    return ((centred / safe_norms[:, numpy.newaxis]).reshape(blocks.shape), norms)
+
+
+def project_blocks(blocks, max_width=4):
+    """ average square blocks down to at most max_width across, scaled so that distances can only shrink """
+    width = blocks.shape[-1]
+    factor = 1
+    while width / factor > max_width and width % (factor * 2) == 0:
+        factor *= 2
+    new_width = width / factor
+    # the mean of each factor x factor cell times factor is an orthogonal projection, so it never lengthens a vector
+    return factor * blocks.reshape(blocks.shape[:-2] + (new_width, factor, new_width, factor)).mean(-1).mean(-2)
+
+
+class IFSNearestPool(object):
+    """ mean removed, unit length resized domains under all eight transforms, in a k-d tree """
+
+    def __init__(self, resized_domains, candidates=8, max_leaves=8, leaf_size=32, quantiser=None):
+        self.quantiser = quantiser
+        # collage error after the best contrast and brightness is |range - mean|^2 (1 - <unit range, unit domain>^2),
+        # so the best domains are the nearest neighbours of the unit range or of its negation
+        self.resized_domains = numpy.asarray(resized_domains, dtype=numpy.float64)
+        if self.resized_domains.ndim != 3 or self.resized_domains.shape[1] != self.resized_domains.shape[2]:
+            raise numpy_ifs.MalformedDomainPoolError
+        self.num_domains, self.height, self.width = self.resized_domains.shape
+        self.length = self.height * self.width
+        self.candidates = candidates
+        self.max_leaves = max_leaves
+        flat_domains = self.resized_domains.reshape(self.num_domains, self.length)
+        self.sum_vals = flat_domains.sum(1)
+        self.sum_sqr_vals = numpy.square(flat_domains).sum(1)
+        (unit_domains, norms) = normalise_blocks(self.resized_domains)
+        # flat domains have no direction, and can only ever be used with zero contrast
+        self.domain_numbers = numpy.flatnonzero(norms > 0)
+        features = project_blocks(unit_domains[self.domain_numbers])
+        points = numpy.empty((len(self.domain_numbers), 8, features.shape[1] * features.shape[2]))
+        for transform_num in xrange(8):
+            points[:, transform_num, :] = numpy_ifs.transform_array(transform_num, features).reshape(len(self.domain_numbers), -1)
+        self.tree = IFSKDTree(points.reshape(len(self.domain_numbers) * 8, -1), leaf_size)
+
+    def find_best(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ calculates best fit (domain, transform, contrast, brightness, fit) among the nearest domains to a given range """
+        if range_matrix.length != self.length or range_matrix.width != self.width:
+            raise numpy_ifs.BadComparisonError
+        if range_sum is None:
+            range_sum = float(range_matrix.sum_vals())
+        if range_sum_sqr is None:
+            range_sum_sqr = float(range_matrix.sum_sqr_vals())
+        range_block = numpy.asarray(range_matrix.data, dtype=numpy.float64).reshape(1, self.height, self.width)
+        (unit_range, norms) = normalise_blocks(range_block)
+        if norms[0] == 0 or len(self.domain_numbers) == 0:
+            # nothing to match a direction against, so brightness alone is the best fit
+            brightness = range_sum / float(self.length)
+            if self.quantiser is not None:
+                brightness = float(self.quantiser.snap_brightness(brightness))
+            error = max(range_sum_sqr - 2.0 * brightness * range_sum + self.length * brightness * brightness, 0.0)
+            return (0, 0, 0.0, brightness, error)
+        feature = project_blocks(unit_range)[0].reshape(-1)
+        rows = set(self.tree.query(feature, self.candidates, self.max_leaves)) | set(self.tree.query(-feature, self.candidates, self.max_leaves))
+        rows = sorted(rows)
+        domain_nums = self.domain_numbers[[row / 8 for row in rows]]
+        transformed = numpy.array([numpy_ifs.transform_array(row % 8, self.resized_domains[domain_num]).reshape(self.length)
+                                   for (row, domain_num) in zip(rows, domain_nums)])
+        sum_rd = transformed.dot(range_block.reshape(self.length))
+        (contrast, brightness, error) = numpy_ifs.solve_collage(self.length, sum_rd, self.sum_vals[domain_nums], self.sum_sqr_vals[domain_nums],
+                                                                range_sum, range_sum_sqr, self.quantiser)
+        best = int(numpy.argmin(error))
+        return (int(domain_nums[best]), rows[best] % 8, float(contrast[best]), float(brightness[best]), float(error[best]))
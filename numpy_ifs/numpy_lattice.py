@@ -0,0 +1,73 @@
+""" domain lattice search functionality of ifs """
+import numpy
+import numpy_ifs
+
+
+class BadDomainStepError(Exception):
+    """ error class for domain lattices """
+
+    def __str__(self):
+        return "Domain step must be at least 1!"
+
+
+def lattice_domains(width_in_domains, height_in_domains, step):
+    """ return the numbers of the domains whose top left corners lie on a lattice of the given spacing """
+    if step < 1:
+        raise BadDomainStepError
+    x_coords = numpy.arange(0, width_in_domains, step)
+    y_coords = numpy.arange(0, height_in_domains, step)
+    return (y_coords[:, numpy.newaxis] * width_in_domains + x_coords).reshape(-1)
+
+
+class IFSLatticePool(object):
+    """ domains on a sparse lattice compared first, then every domain near the best few of them """
+
+    def __init__(self, resized_domains, width_in_domains, height_in_domains, step, candidates=4, quantiser=None):
+        self.quantiser = quantiser
+        resized_domains = numpy.asarray(resized_domains, dtype=numpy.float64)
+        if resized_domains.ndim != 3 or resized_domains.shape[1] != resized_domains.shape[2]:
+            raise numpy_ifs.MalformedDomainPoolError
+        self.num_domains, self.height, self.width = resized_domains.shape
+        self.length = self.height * self.width
+        self.data = resized_domains.reshape(self.num_domains, self.length)
+        self.sum_vals = self.data.sum(1)
+        self.sum_sqr_vals = numpy.square(self.data).sum(1)
+        self.width_in_domains = width_in_domains
+        self.height_in_domains = height_in_domains
+        self.step = step
+        self.candidates = candidates
+        self.lattice = lattice_domains(width_in_domains, height_in_domains, step)
+        # every domain is within step - 1 positions of a lattice domain in each direction
+        self.offsets = numpy.arange(1 - step, step)
+
+    def solve(self, domain_nums, kernels, range_sum, range_sum_sqr):
+        """ contrast, brightness and squared error of some domains under every transform, indexed [position, transform_num], given the range kernels """
+        sum_rd = self.data[domain_nums].dot(kernels.T)
+        return numpy_ifs.solve_collage(self.length, sum_rd, self.sum_vals[domain_nums, numpy.newaxis], self.sum_sqr_vals[domain_nums, numpy.newaxis],
+                                       range_sum, range_sum_sqr, self.quantiser)
+
+    def neighbourhood(self, domain_nums):
+        """ return the numbers of the domains within step - 1 positions of any of the given domains """
+        x_coords = numpy.clip((domain_nums % self.width_in_domains)[:, numpy.newaxis, numpy.newaxis] + self.offsets[numpy.newaxis, numpy.newaxis, :],
+                              0, self.width_in_domains - 1)
+        y_coords = numpy.clip((domain_nums / self.width_in_domains)[:, numpy.newaxis, numpy.newaxis] + self.offsets[numpy.newaxis, :, numpy.newaxis],
+                              0, self.height_in_domains - 1)
+        return numpy.unique(y_coords * self.width_in_domains + x_coords)
+
+    def find_best(self, range_matrix, range_sum=None, range_sum_sqr=None):
+        """ calculates best fit (domain, transform, contrast, brightness, fit) for a given range """
+        if range_matrix.length != self.length or range_matrix.width != self.width:
+            raise numpy_ifs.BadComparisonError
+        if range_sum is None:
+            range_sum = float(range_matrix.sum_vals())
+        if range_sum_sqr is None:
+            range_sum_sqr = float(range_matrix.sum_sqr_vals())
+        kernels = numpy_ifs.transformed_range_kernels(range_matrix.data).reshape(8, self.length)
+        error = self.solve(self.lattice, kernels, range_sum, range_sum_sqr)[2].min(1)
+        num_hits = min(self.candidates, len(self.lattice))
+        hits = self.lattice[numpy.argpartition(error, num_hits - 1)[:num_hits]]
+        nearby = self.neighbourhood(hits)
+        (contrast, brightness, error) = self.solve(nearby, kernels, range_sum, range_sum_sqr)
+        best = int(numpy.argmin(error))
+        (position, transform_num) = divmod(best, 8)
+        return (int(nearby[position]), transform_num, float(contrast.flat[best]), float(brightness.flat[best]), float(error.flat[best]))
@@ -131,6 +131,7 @@ class IFSMatrix(object):
             if new_height > self.height:
                 raise InvalidSizeError
             return self.reduce(new_width, new_height)
+        return self.identity()
 
     def expand(self, new_width, new_height=None):
         """ expand to new_width, new_height """
@@ -163,31 +164,98 @@ def diff_ifs_matrices(matrix_a, matrix_b):
     return numpy.sum(numpy.absolute(numpy.subtract(matrix_a.data, matrix_b.data)))
 
 
-def find_best_transform(range_matrix, domain_matrix):
-    """ calculates best fit transform for a domain to match a given range """
+class IFSSearchStats(object):
+    """ counts of candidate transforms compared, skipped on their lower bound, and abandoned part way through their fit """
+
+    def __init__(self):
+        self.candidates = 0
+        self.skipped = 0
+        self.aborted = 0
+
+    def __str__(self):
+        if self.candidates == 0:
+            return "no candidates compared"
+        return "{} candidates, {} skipped on lower bound ({:.1f}%), {} aborted part way ({:.1f}%)".format(
+            self.candidates, self.skipped, 100.0 * self.skipped / self.candidates, self.aborted, 100.0 * self.aborted / self.candidates)
+
+    def add(self, other):
+        """ add in the counts from another set of stats """
+        self.candidates += other.candidates
+        self.skipped += other.skipped
+        self.aborted += other.aborted
+
+
+def find_best_transform(range_matrix, domain_matrix, range_sum=None, domain_sum=None, domain_sum_sqr=None,
+                        range_sum_sqr=None, best_fit=None, stats=None, quantiser=None, transform_nums=None,
+                        fit_threshold=None):
+    """ calculates best fit transform for a domain to match a given range, if it can beat best_fit, trying only transform_nums if given
+        and stopping at the first fit within fit_threshold (default one per pixel) """
     if range_matrix.length != domain_matrix.length or range_matrix.width != domain_matrix.width:
         raise BadComparisonError
-    best_fit_value = 9999999999
+    # sums do not change under any of the transforms, so they are only looked up once
+    if range_sum is None:
+        range_sum = range_matrix.sum_vals()
+    if domain_sum is None:
+        domain_sum = domain_matrix.sum_vals()
+    if domain_sum_sqr is None:
+        domain_sum_sqr = domain_matrix.sum_sqr_vals()
+    if range_sum_sqr is None:
+        range_sum_sqr = range_matrix.sum_sqr_vals()
+    if stats is None:
+        stats = IFSSearchStats()
+    best_fit_value = 9999999999 if best_fit is None else best_fit
     best_transform = None
     best_contrast = None
     best_brightness = None
-    data = [0] * range_matrix.length
-    transformed_domain = IFSMatrix(range_matrix.width, data)
-    for transform_num in xrange(8):
-        transformed_domain = apply_transform(transform_num, domain_matrix)
-        contrast = calculate_contrast(range_matrix, transformed_domain)
-        brightness = calculate_brightness(range_matrix, transformed_domain, contrast)
-        transformed_domain = transformed_domain.adjust_contrast(contrast)
-        transformed_domain = transformed_domain.adjust_brightness(brightness)
-        fit_value = diff_ifs_matrices(range_matrix, transformed_domain)
-        fit_threshold = float(range_matrix.length) * 1
-        if fit_value < fit_threshold:
+    length = float(range_matrix.length)
+    if fit_threshold is None:
+        fit_threshold = length * 1
+    half_height = (range_matrix.height + 1) / 2
+    if transform_nums is None:
+        transform_nums = xrange(8)
+    transformed_domains = [transform_array(transform_num, domain_matrix.data) for transform_num in transform_nums]
+    sums_rd = numpy.array(transformed_domains).reshape(len(transformed_domains), range_matrix.length).dot(range_matrix.data.reshape(range_matrix.length))
+    divisor = (length * float(domain_sum_sqr)) - (float(domain_sum) * float(domain_sum))
+    range_spread = float(range_sum_sqr) - float(range_sum) * float(range_sum) / length
+    domain_spread = float(domain_sum_sqr) - float(domain_sum) * float(domain_sum) / length
+    for (position, transform_num) in enumerate(transform_nums):
+        stats.candidates += 1
+        sum_rd = float(sums_rd[position])
+        if divisor == 0:
+            contrast = 0.0
+        else:
+            contrast = ((length * sum_rd) - (float(domain_sum) * float(range_sum))) / divisor
+        if quantiser is not None:
+            contrast = float(quantiser.snap_contrast(contrast))
+        brightness = (float(range_sum) - (contrast * float(domain_sum))) / length
+        if quantiser is not None:
+            brightness = float(quantiser.snap_brightness(brightness))
+        # no contrast and brightness can leave less squared error than the range spread the domain fails to correlate with,
+        # and the absolute error is never less than the root of the squared error
+        if domain_spread > 0:
+            covariance = sum_rd - float(range_sum) * float(domain_sum) / length
+            unexplained = range_spread - covariance * covariance / domain_spread
+        else:
+            unexplained = range_spread
+        if math.sqrt(max(unexplained, 0.0)) >= best_fit_value:
+            stats.skipped += 1
+            continue
+        # the error is summed a half at a time, and abandoned if the first half already reaches the best so far
+        transformed_domain = transformed_domains[position]
+        fit_value = numpy.sum(numpy.absolute(range_matrix.data[:half_height] - (contrast * transformed_domain[:half_height] + brightness)))
+        if fit_value >= best_fit_value:
+            stats.aborted += 1
+            continue
+        fit_value += numpy.sum(numpy.absolute(range_matrix.data[half_height:] - (contrast * transformed_domain[half_height:] + brightness)))
+        if fit_value >= best_fit_value:
+            stats.aborted += 1
+            continue
+        if fit_value <= fit_threshold:
             return (transform_num, contrast, brightness, fit_value)
-        elif fit_value < best_fit_value:
-            best_fit_value = fit_value
-            best_transform = transform_num
-            best_contrast = contrast
-            best_brightness = brightness
+        best_fit_value = fit_value
+        best_transform = transform_num
+        best_contrast = contrast
+        best_brightness = brightness
     return (best_transform, best_contrast, best_brightness, best_fit_value)
 
 
@@ -213,10 +281,56 @@ def apply_transform(transform_num, matrix):
     return None
 
 
-def calculate_contrast(range_matrix, domain_matrix):
+def transform_array(transform_num, data):
+    """ applies a given transform to the last two axes of an array, numbered as in apply_transform """
+    if transform_num == 0:
+        return data
+    if transform_num == 1:
+        return numpy.rot90(data, 2, axes=(-2, -1))
+    if transform_num == 2:
+        return numpy.flip(data, -1)
+    if transform_num == 3:
+        return numpy.flip(data, -2)
+    if transform_num == 4:
+        return numpy.swapaxes(data, -2, -1)
+    if transform_num == 5:
+        return numpy.rot90(numpy.swapaxes(data, -2, -1), 2, axes=(-2, -1))
+    if transform_num == 6:
+        return numpy.rot90(data, 3, axes=(-2, -1))
+    if transform_num == 7:
+        return numpy.rot90(data, 1, axes=(-2, -1))
+    return None
+
+
+def build_transform_tables():
+    """ work out how the transforms compose, [first][second] meaning second then first, and which undoes each """
+    probe = numpy.arange(9).reshape(3, 3)
+    results = [transform_array(transform_num, probe).tolist() for transform_num in xrange(8)]
+    composition = [[results.index(transform_array(first, transform_array(second, probe)).tolist()) for second in xrange(8)] for first in xrange(8)]
+    inverse = [composition[transform_num].index(0) for transform_num in xrange(8)]
+    return (composition, inverse)
+
+
+(TRANSFORM_COMPOSITION, TRANSFORM_INVERSE) = build_transform_tables()
+
+
+def transformed_range_kernels(range_data):
+    """ return a square block under the inverse of every transform, as an (8, height, width) array indexed by transform_num """
+    # <range, transform(domain)> = <inverse transform(range), domain>, so the range is transformed instead of every domain
+    range_data = numpy.asarray(range_data, dtype=numpy.float64)
+    return numpy.array([transform_array(TRANSFORM_INVERSE[transform_num], range_data) for transform_num in xrange(8)])
+
+
+def calculate_contrast(range_matrix, domain_matrix, range_sum=None, domain_sum=None, domain_sum_sqr=None):
     """ calculates required contrast change to domain to approximate range """
     if range_matrix.length != domain_matrix.length or range_matrix.width != domain_matrix.width:
         raise BadComparisonError
+    if range_sum is None:
+        range_sum = range_matrix.sum_vals()
+    if domain_sum is None:
+        domain_sum = domain_matrix.sum_vals()
+    if domain_sum_sqr is None:
+        domain_sum_sqr = domain_matrix.sum_sqr_vals()
     # sum_rd = 0
     # for count in xrange(range_matrix.length):
     #     sum_rd += range_matrix.data[count] * domain_matrix.data[count]
@@ -231,18 +345,22 @@ def calculate_contrast(range_matrix, domain_matrix):
         print domain_matrix.length
         print ve
         raise ve
-    divisor = ((float(range_matrix.length) * float(domain_matrix.sum_sqr_vals())) - (float(domain_matrix.sum_vals()) * float(domain_matrix.sum_vals())))
+    divisor = ((float(range_matrix.length) * float(domain_sum_sqr)) - (float(domain_sum) * float(domain_sum)))
     if divisor == 0:
         contrast = 0.0
     else:
-        contrast = (((float(domain_matrix.length) * float(sum_rd)) - (float(domain_matrix.sum_vals()) * float(range_matrix.sum_vals()))) / float(divisor))
+        contrast = (((float(domain_matrix.length) * float(sum_rd)) - (float(domain_sum) * float(range_sum))) / float(divisor))
     return contrast
 
 
-def calculate_brightness(range_matrix, domain_matrix, contrast):
+def calculate_brightness(range_matrix, domain_matrix, contrast, range_sum=None, domain_sum=None):
     """ calculates required brightness change to domain to approximate range for given contrast """
     if range_matrix.length != domain_matrix.length or range_matrix.width != domain_matrix.width:
         raise BadComparisonError
+    if range_sum is None:
+        range_sum = range_matrix.sum_vals()
+    if domain_sum is None:
+        domain_sum = domain_matrix.sum_vals()
     # print "calculating brightness"
     # print "sumD:     " + str(domain_matrix.sum_vals())
     # print "sumR:     " + str(range_matrix.sum_vals())
@@ -251,7 +369,7 @@ def calculate_brightness(range_matrix, domain_matrix, contrast):
     # print "brightness = ( sumD - contrast * sumR ) / n"
     # print("brightness = " + str(float(range_matrix.sum_vals())) + " - (" + str(float(contrast)) + " * " +
     #      str(domain_matrix.sum_vals()) + ") / " + str(float(range_matrix.length)))
-    brightness = (float(range_matrix.sum_vals()) - (float(contrast * domain_matrix.sum_vals()))) / float(range_matrix.length)
+    brightness = (float(range_sum) - (float(contrast * domain_sum))) / float(range_matrix.length)
     # print "brightness: " + str(brightness)
     return brightness
 
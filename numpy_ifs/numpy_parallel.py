@@ -0,0 +1,45 @@
+""" multi-process encoding functionality of ifs """
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy
+import numpy_ifs
+
+# each worker process keeps the encoder it inherited when the pool forked
+worker_encoder = None
+
+
+def create_shared_array(shape):
+    """ allocate a float array in shared memory, which forked workers see without it being pickled """
+    size = 1
+    for dimension in shape:
+        size *= dimension
+    shared_buffer = multiprocessing.sharedctypes.RawArray('d', size)
+    return numpy.frombuffer(shared_buffer, dtype=numpy.float64).reshape(shape)
+
+
+def init_encode_worker(encoder):
+    """ store the encoder in a newly started worker process """
+    global worker_encoder
+    worker_encoder = encoder
+
+
+def encode_range_in_worker(range_num):
+    """ encode a range using the worker's encoder, returning the search stats for just that range alongside """
+    worker_encoder.stats = numpy_ifs.IFSSearchStats()
+    return (worker_encoder.encode_range(range_num), worker_encoder.stats)
+
+
+def encode_ranges_in_parallel(encoder, start, workers, chunksize=None):
+    """ yield the encoding of every range from start onwards, in range order, using a pool of worker processes """
+    range_nums = xrange(start, encoder.image.num_ranges)
+    if chunksize is None:
+        chunksize = max(1, len(range_nums) / (workers * 16))
+    pool = multiprocessing.Pool(workers, init_encode_worker, (encoder,))
+    try:
+        for (result, stats) in pool.imap(encode_range_in_worker, range_nums, chunksize):
+            encoder.stats.add(stats)
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
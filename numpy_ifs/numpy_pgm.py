@@ -0,0 +1,91 @@
+""" pgm file functionality of ifs """
+import mmap
+import re
+import numpy
+
+PGM_WHITESPACE = " \t\r\n\v\f"
+PGM_COMMENT = re.compile(r"#[^\n]*")
+
+
+class MalformedPGMError(Exception):
+    """ error class for pgm files """
+
+    def __str__(self):
+        return "Malformed pgm file!"
+
+
+def parse_pgm_header(buf):
+    """ return the (magic, width, height, whiteval) of a pgm header and where the raster starts, skipping any comments """
+    tokens = []
+    position = 0
+    while len(tokens) < 4:
+        while position < len(buf) and (buf[position] in PGM_WHITESPACE or buf[position] == "#"):
+            if buf[position] == "#":
+                while position < len(buf) and buf[position] != "\n":
+                    position += 1
+            else:
+                position += 1
+        start = position
+        while position < len(buf) and buf[position] not in PGM_WHITESPACE and buf[position] != "#":
+            position += 1
+        if start == position:
+            raise MalformedPGMError
+        tokens.append(buf[start:position])
+    (magic, width, height, whiteval) = tokens
+    if magic not in ("P2", "P5"):
+        raise MalformedPGMError
+    try:
+        (width, height, whiteval) = (int(width), int(height), int(whiteval))
+    except ValueError:
+        raise MalformedPGMError
+    if width <= 0 or height <= 0 or not 0 < whiteval < 65536:
+        raise MalformedPGMError
+    # a single whitespace character separates the header from the raster
+    return (magic, width, height, whiteval, position + 1)
+
+
+def pgm_dtype(whiteval):
+    """ the raster type of a binary pgm file, one byte per pixel or two big endian bytes """
+    if whiteval < 256:
+        return numpy.dtype(numpy.uint8)
+    return numpy.dtype('>u2')
+
+
+def read_pgm(filename, use_mmap=False):
+    """ read a P2 or P5 pgm file, returning (width, height, whiteval, pixels) with the pixels as a height x width array """
+    with open(filename, 'rb') as pgm_file:
+        if use_mmap:
+            buf = mmap.mmap(pgm_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = pgm_file.read()
+    (magic, width, height, whiteval, start) = parse_pgm_header(buf)
+    if magic == "P5":
+        dtype = pgm_dtype(whiteval)
+        if len(buf) < start + width * height * dtype.itemsize:
+            raise MalformedPGMError
+        # mapped pixels are read straight from the file, only when used
+        pixels = numpy.frombuffer(buf, dtype=dtype, count=width * height, offset=start)
+    else:
+        raster = buf[start:]
+        if "#" in raster:
+            raster = PGM_COMMENT.sub(" ", raster)
+        pixels = numpy.fromstring(raster, dtype=numpy.int64, sep=" ")
+        if pixels.size != width * height:
+            raise MalformedPGMError
+    return (width, height, whiteval, pixels.reshape(height, width))
+
+
+def write_pgm(filename, pixels, whiteval, binary=False):
+    """ write pixels to a P2 (or, if binary, P5) pgm file, clamped to 0 .. whiteval """
+    pixels = numpy.asarray(pixels)
+    clipped = numpy.clip(pixels, 0, whiteval).astype(numpy.int64)
+    header = "P5\n" if binary else "P2\n"
+    header += "# ifs compressor\n"
+    header += str(pixels.shape[1]) + " " + str(pixels.shape[0]) + "\n"
+    header += str(whiteval) + "\n"
+    if binary:
+        raster = clipped.astype(pgm_dtype(whiteval)).tostring()
+    else:
+        raster = "\n".join(map(str, clipped.ravel().tolist())) + "\n"
+    with open(filename, 'wb') as pgm_file:
+        pgm_file.write(header + raster)
@@ -0,0 +1,104 @@
+""" multiresolution pyramid encoding functionality of ifs """
+import numpy
+import numpy_ifs
+
+
+class BadPyramidLevelsError(Exception):
+    """ error class for IFSPyramidEncoder """
+
+    def __str__(self):
+        return "Range and domain sizes must halve exactly at every pyramid level, leaving ranges of at least 2!"
+
+
+def max_pyramid_levels(range_size, domain_size):
+    """ return the most levels below full resolution at which range and domain sizes halve exactly, leaving ranges of at least 2 """
+    levels = 0
+    while range_size % 2 == 0 and domain_size % 2 == 0 and range_size / 2 >= 2:
+        range_size /= 2
+        domain_size /= 2
+        levels += 1
+    return levels
+
+
+def halve_image(data):
+    """ return an image averaged down two by two to half its width and height """
+    (height, width) = data.shape
+    return data.reshape(height / 2, 2, width / 2, 2).mean(3).mean(1)
+
+
+class IFSPyramidEncoder(object):
+    """ compares each range with every domain at the coarsest level of an image pyramid, then with the domains near the best few at each finer level """
+
+    def __init__(self, image, levels, radius=2, candidates=8, decimate=False, quantiser=None, flat_threshold=None, domain_step=1):
+        if levels < 0 or levels > max_pyramid_levels(image.range_size, image.domain_size):
+            raise BadPyramidLevelsError
+        self.image = image
+        self.levels = levels
+        self.radius = radius
+        self.candidates = candidates
+        self.decimate = decimate
+        self.quantiser = quantiser
+        self.stats = numpy_ifs.IFSSearchStats()
+        # every level halves the image, its ranges and its domains, so range numbers are the same at every level
+        # and domain (x, y) at one level covers the same part of the image as domain (2x, 2y) at the level below
+        self.images = [image]
+        data = numpy.asarray(image.data, dtype=numpy.float64).reshape(image.height, image.width)
+        for level in xrange(1, levels + 1):
+            data = halve_image(data)
+            self.images.append(numpy_ifs.IFSImage(data.shape[1], image.whiteval, image.range_size >> level, image.domain_size >> level, data))
+        self.resized_domains = [None] * (levels + 1)
+        coarsest = self.images[levels]
+        self.coarse_domains = numpy_ifs.lattice_domains(coarsest.width_in_domains, coarsest.height_in_domains, domain_step)
+        # flat ranges are picked out at full resolution before any level is searched
+        self.flat_encoder = numpy_ifs.IFSEncoder(image, 'full', decimate, quantiser=quantiser, flat_threshold=flat_threshold)
+
+    def get_resized_domains(self, level):
+        """ return every domain of a level resized to range size and flattened, with their sums and sums of squares """
+        if self.resized_domains[level] is None:
+            image = self.images[level]
+            resized = image.get_resized_domains(self.decimate).reshape(image.num_domains, image.range_size * image.range_size).astype(numpy.float64)
+            self.resized_domains[level] = (resized, resized.sum(1), numpy.square(resized).sum(1))
+        return self.resized_domains[level]
+
+    def solve(self, level, range_num, domain_nums):
+        """ contrast, brightness and squared error of some domains of a level against a range, indexed [position, transform_num] """
+        image = self.images[level]
+        (resized, sum_vals, sum_sqr_vals) = self.get_resized_domains(level)
+        length = image.range_size * image.range_size
+        (range_sum, range_sum_sqr) = image.get_range_sums(range_num)
+        kernels = numpy_ifs.transformed_range_kernels(image.get_range(range_num).data).reshape(8, length)
+        self.stats.candidates += len(domain_nums) * 8
+        return numpy_ifs.solve_collage(length, resized[domain_nums].dot(kernels.T), sum_vals[domain_nums, numpy.newaxis],
+                                       sum_sqr_vals[domain_nums, numpy.newaxis], range_sum, range_sum_sqr, self.quantiser)
+
+    def window(self, level, coarse_domain_num):
+        """ return the domains of a level within radius of where a domain of the level above lands on it """
+        image = self.images[level]
+        coarse_width = self.images[level + 1].width_in_domains
+        (x_centre, y_centre) = (2 * (coarse_domain_num % coarse_width), 2 * (coarse_domain_num / coarse_width))
+        x_coords = numpy.arange(max(x_centre - self.radius, 0), min(x_centre + self.radius, image.width_in_domains - 1) + 1)
+        y_coords = numpy.arange(max(y_centre - self.radius, 0), min(y_centre + self.radius, image.height_in_domains - 1) + 1)
+        return (y_coords[:, numpy.newaxis] * image.width_in_domains + x_coords).reshape(-1)
+
+    def encode_range(self, range_num):
+        """ return (domain, transform, contrast, brightness, fit) for a given range at full resolution """
+        flat_code = self.flat_encoder.encode_flat_range(range_num)
+        if flat_code is not None:
+            return flat_code
+        domain_nums = self.coarse_domains
+        (contrast, brightness, error) = self.solve(self.levels, range_num, domain_nums)
+        for level in xrange(self.levels - 1, -1, -1):
+            # the best few domains are kept, since the coarse image cannot tell apart domains that differ only in detail
+            domain_errors = error.min(1)
+            num_hits = min(self.candidates, len(domain_nums))
+            hits = domain_nums[numpy.argpartition(domain_errors, num_hits - 1)[:num_hits]]
+            domain_nums = numpy.unique(numpy.concatenate([self.window(level, domain_num) for domain_num in hits]))
+            (contrast, brightness, error) = self.solve(level, range_num, domain_nums)
+        best = int(numpy.argmin(error))
+        (position, transform_num) = divmod(best, 8)
+        return (int(domain_nums[position]), transform_num, float(contrast.flat[best]), float(brightness.flat[best]), float(error.flat[best]))
+
+    def encode_ranges(self, start=0):
+        """ yield the encoding of every range from start onwards, in range order """
+        for range_num in xrange(start, self.image.num_ranges):
+            yield self.encode_range(range_num)
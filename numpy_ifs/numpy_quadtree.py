@@ -0,0 +1,172 @@
+""" quadtree range partitioning functionality of ifs """
+import math
+import numpy
+import numpy_ifs
+
+QUADTREE_IFS_MAGIC = "#IFSQ"
+# the quadrant of a block, numbered along each row
+QUADRANT_GRID = numpy.arange(4).reshape(2, 2)
+
+
+class BadQuadtreeSizeError(Exception):
+    """ error class for IFSQuadtreeEncoder """
+
+    def __str__(self):
+        return "Quadtree range sizes must halve from the largest to the smallest, and the largest must tile the image!"
+
+
+class MalformedQuadtreeIFSError(Exception):
+    """ error class for quadtree ifs files """
+
+    def __str__(self):
+        return "Malformed quadtree ifs file!"
+
+
+def quadtree_sizes(max_range_size, min_range_size):
+    """ return the range sizes of every level of a quadtree, largest first """
+    sizes = [max_range_size]
+    while sizes[-1] > min_range_size:
+        if sizes[-1] % 2 != 0:
+            raise BadQuadtreeSizeError
+        sizes.append(sizes[-1] / 2)
+    if sizes[-1] != min_range_size:
+        raise BadQuadtreeSizeError
+    return sizes
+
+
+class IFSQuadtreeEncoder(object):
+    """ encodes large ranges, splitting any that no domain fits well enough into four, down to a smallest size """
+
+    def __init__(self, width, whiteval, data, max_range_size, min_range_size, split_threshold, search='classified', decimate=False,
+                 verbosity=0, candidates=8, quantiser=None, flat_threshold=None, domain_step=1, canonical=False):
+        self.width = width
+        self.whiteval = whiteval
+        self.data = numpy.asarray(data)
+        self.height = self.data.size / width
+        self.sizes = quadtree_sizes(max_range_size, min_range_size)
+        if width % max_range_size != 0 or self.height % max_range_size != 0:
+            raise BadQuadtreeSizeError
+        # a range is kept whole once its rms collage error is at most the threshold
+        self.split_threshold = split_threshold
+        self.search = search
+        self.decimate = decimate
+        self.verbosity = verbosity
+        self.candidates = candidates
+        self.quantiser = quantiser
+        self.flat_threshold = flat_threshold
+        self.domain_step = domain_step
+        self.canonical = canonical
+        self.levels = {}
+        self.warm_starts = 0
+
+    def get_level(self, size):
+        """ return the encoder for ranges of a given size, with domains twice their size """
+        if size not in self.levels:
+            image = numpy_ifs.IFSImage(self.width, self.whiteval, size, 2 * size, self.data)
+            self.levels[size] = numpy_ifs.IFSEncoder(image, self.search, self.decimate, False, self.verbosity, self.candidates,
+                                                     self.quantiser, self.flat_threshold, self.domain_step, canonical=self.canonical)
+        return self.levels[size]
+
+    def fit_domain(self, level, range_num, domain_num, transform_num):
+        """ return (domain, transform, contrast, brightness, squared error) for a range using a given domain and transform """
+        range_data = numpy.asarray(level.image.get_range(range_num).data, dtype=numpy.float64)
+        (range_sum, range_sum_sqr) = level.image.get_range_sums(range_num)
+        (resized_domain, (domain_sum, domain_sum_sqr)) = level.get_resized_domain(domain_num)
+        sum_rd = float((numpy_ifs.transform_array(transform_num, resized_domain.data) * range_data).sum())
+        (contrast, brightness, error) = numpy_ifs.solve_collage(range_data.size, sum_rd, domain_sum, domain_sum_sqr, range_sum, range_sum_sqr, self.quantiser)
+        return (domain_num, transform_num, float(contrast), float(brightness), float(error))
+
+    def good_enough(self, code, size):
+        """ whether a code's rms error is within the split threshold """
+        return math.sqrt(code[4] / float(size * size)) <= self.split_threshold
+
+    def child_warm_start(self, code, size, x_quadrant, y_quadrant):
+        """ return the (domain, transform) for a quadrant of a range that matches the part of its parent's domain that maps onto it """
+        (domain_num, transform_num) = code[:2]
+        # the parent's ranges are twice the size of the child's, and every domain twice the size of its range
+        parent_domains_across = self.width + 1 - 4 * size
+        (x_coord, y_coord) = (domain_num % parent_domains_across, domain_num / parent_domains_across)
+        # a transform of the whole domain puts the transform of one of its quadrants in each quadrant
+        (y_source, x_source) = divmod(int(numpy_ifs.transform_array(transform_num, QUADRANT_GRID)[y_quadrant, x_quadrant]), 2)
+        return ((y_coord + y_source * 2 * size) * (self.width + 1 - 2 * size) + x_coord + x_source * 2 * size, transform_num)
+
+    def encode_block(self, x_coord, y_coord, size, warm_start=None):
+        """ yield (x, y, size, domain, transform, contrast, brightness) for the leaves covering a block, splitting it as needed """
+        level = self.get_level(size)
+        range_num = (y_coord / size) * level.image.width_in_ranges + x_coord / size
+        code = None
+        if warm_start is not None:
+            code = self.fit_domain(level, range_num, warm_start[0], warm_start[1])
+        if code is not None and self.good_enough(code, size):
+            self.warm_starts += 1
+        else:
+            found = level.encode_range(range_num)
+            # searches measure fit in different ways, so the squared error is worked out the same way for all of them
+            if not numpy_ifs.is_flat_code(found):
+                found = self.fit_domain(level, range_num, found[0], found[1])
+            if code is None or found[4] < code[4]:
+                code = found
+        if size > self.sizes[-1] and not self.good_enough(code, size):
+            half = size / 2
+            # the quadrants of a flat code's domain are no better a start than any other domain
+            flat = numpy_ifs.is_flat_code(code)
+            for y_quadrant in xrange(2):
+                for x_quadrant in xrange(2):
+                    for leaf in self.encode_block(x_coord + x_quadrant * half, y_coord + y_quadrant * half, half,
+                                                  None if flat else self.child_warm_start(code, half, x_quadrant, y_quadrant)):
+                        yield leaf
+        else:
+            yield (x_coord, y_coord, size) + code[:4]
+
+    def encode(self):
+        """ yield the leaves of the quadtree, each largest range depth first, in rows of largest ranges """
+        size = self.sizes[0]
+        for y_coord in xrange(0, self.height, size):
+            for x_coord in xrange(0, self.width, size):
+                for leaf in self.encode_block(x_coord, y_coord, size):
+                    yield leaf
+
+
+def compile_quadtree_plan(image, leaves):
+    """ compile quadtree leaves into a decode plan for an image whose ranges are the smallest leaf size """
+    (x_coords, y_coords, sizes, domains, transforms, contrasts, brightnesses) = [numpy.array(field) for field in zip(*leaves)]
+    (domains, contrasts) = numpy_ifs.resolve_flat_codes(domains, contrasts.astype(numpy.float64))
+    domains_across = image.width + 1 - 2 * sizes
+    domains_down = image.height + 1 - 2 * sizes
+    if domains.min() < 0 or (domains >= domains_across * domains_down).any():
+        raise numpy_ifs.OutOfArrayError("quadtree codes refer to a domain outside the image!")
+    return numpy_ifs.IFSDecodePlan.compile_ranges(image, x_coords, y_coords, sizes, domains % domains_across, domains / domains_across,
+                                                  transforms, contrasts, brightnesses)
+
+
+def is_quadtree_ifs(filename):
+    """ check whether a file starts like a quadtree ifs file """
+    with open(filename, 'rb') as ifs_file:
+        return ifs_file.readline().rstrip('\n') == QUADTREE_IFS_MAGIC
+
+
+def write_quadtree_ifs(filename, width, height, whiteval, max_range_size, min_range_size, leaves):
+    """ write quadtree leaves to a file, one (x, y, size, domain, transform, contrast, brightness) per line """
+    with open(filename, 'w') as ifs_file:
+        ifs_file.write(QUADTREE_IFS_MAGIC + "\n")
+        ifs_file.write(" ".join(str(value) for value in (width, height, max_range_size, min_range_size, whiteval)) + "\n")
+        for leaf in leaves:
+            ifs_file.write(" ".join(str(value) for value in leaf) + "\n")
+
+
+def read_quadtree_ifs(filename):
+    """ read (width, height, max range size, min range size, whiteval, leaves) from a quadtree ifs file """
+    with open(filename, 'r') as ifs_file:
+        if ifs_file.readline().rstrip('\n') != QUADTREE_IFS_MAGIC:
+            raise MalformedQuadtreeIFSError
+        try:
+            (width, height, max_range_size, min_range_size, whiteval) = [int(value) for value in ifs_file.readline().split()]
+            leaves = []
+            for line in ifs_file:
+                (x_coord, y_coord, size, domain, transform, contrast, brightness) = line.split()
+                leaves.append((int(x_coord), int(y_coord), int(size), int(domain), int(transform), float(contrast), float(brightness)))
+        except ValueError:
+            raise MalformedQuadtreeIFSError
+    if sum(leaf[2] * leaf[2] for leaf in leaves) != width * height:
+        raise MalformedQuadtreeIFSError
+    return (width, height, max_range_size, min_range_size, whiteval, leaves)
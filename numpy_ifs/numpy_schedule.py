@@ -0,0 +1,143 @@
+""" dependency ordered decoding functionality of ifs """
+import math
+import numpy
+
+
+def range_dependencies(plan):
+    """ return (starts, targets) listing, for every range, the ranges its domain reads from, as compressed rows """
+    range_sizes = numpy.diff(plan.range_starts)
+    row_ranges = numpy.repeat(numpy.arange(plan.num_ranges), range_sizes)
+    pixel_ranges = numpy.empty(len(plan.destinations), dtype=numpy.intp)
+    pixel_ranges[plan.destinations] = row_ranges
+    # a range with zero contrast ignores its domain, so it depends on nothing
+    readers = plan.contrasts != 0
+    pairs = numpy.unique(row_ranges[readers, numpy.newaxis] * plan.num_ranges + pixel_ranges[plan.sources[readers]])
+    (readers, targets) = divmod(pairs, plan.num_ranges)
+    starts = numpy.zeros(plan.num_ranges + 1, dtype=numpy.intp)
+    starts[1:] = numpy.cumsum(numpy.bincount(readers, minlength=plan.num_ranges))
+    return (starts, targets)
+
+
+def strongly_connected_components(starts, targets):
+    """ return the strongly connected components of a graph given as compressed rows, each after every component it points to """
+    # tarjan's algorithm, with an explicit stack of (node, next edge) in place of recursion
+    starts = starts.tolist()
+    targets = targets.tolist()
+    num_nodes = len(starts) - 1
+    index = [-1] * num_nodes
+    lowlink = [0] * num_nodes
+    on_stack = [False] * num_nodes
+    stack = []
+    components = []
+    counter = 0
+    for root in xrange(num_nodes):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, starts[root])]
+        while work:
+            (node, edge) = work[-1]
+            if edge < starts[node + 1]:
+                work[-1] = (node, edge + 1)
+                target = targets[edge]
+                if index[target] == -1:
+                    index[target] = lowlink[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = True
+                    work.append((target, starts[target]))
+                elif on_stack[target]:
+                    lowlink[node] = min(lowlink[node], index[target])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+
+class IFSDecodeSchedule(object):
+    """ the ranges of a decode plan in dependency order, so that each is only applied once the ranges it reads are final """
+
+    def __init__(self, plan):
+        self.plan = plan
+        (starts, targets) = range_dependencies(plan)
+        self.components = strongly_connected_components(starts, targets)
+        self.dependency_starts = starts
+        self.dependencies = targets
+        # a lone range is only cyclic when its domain reads from itself
+        self.cyclic = [len(component) > 1 or component[0] in targets[starts[component[0]]:starts[component[0] + 1]]
+                       for component in self.components]
+        self.applications = 0
+
+    def num_cyclic_ranges(self):
+        """ return the number of ranges that have to be iterated """
+        return sum(len(component) for (component, cyclic) in zip(self.components, self.cyclic) if cyclic)
+
+    def num_cycles(self):
+        """ return the number of components that have to be iterated """
+        return sum(1 for cyclic in self.cyclic if cyclic)
+
+    def depth(self):
+        """ return the longest chain of components that each read the one before, which sweeps need to pass values along """
+        component_nums = numpy.empty(len(self.dependency_starts) - 1, dtype=numpy.intp)
+        for (component_num, component) in enumerate(self.components):
+            component_nums[component] = component_num
+        levels = []
+        for (component_num, component) in enumerate(self.components):
+            level = 0
+            for range_num in component:
+                for dependency in component_nums[self.dependencies[self.dependency_starts[range_num]:self.dependency_starts[range_num + 1]]]:
+                    if dependency != component_num:
+                        level = max(level, levels[dependency])
+            levels.append(level + 1)
+        return max(levels) if levels else 0
+
+    def largest_cyclic_contrast(self):
+        """ return the largest contrast magnitude in any cycle of ranges, which contraction_bound can only improve on """
+        # errors only persist by going round cycles, so ranges outside them do not slow convergence
+        range_contrasts = numpy.absolute(self.plan.range_contrasts())
+        cyclic_ranges = [range_num for (component, cyclic) in zip(self.components, self.cyclic) if cyclic for range_num in component]
+        if not cyclic_ranges:
+            return 0.0
+        return float(range_contrasts[cyclic_ranges].max())
+
+    def decode(self, image, max_passes=64):
+        """ apply every range in dependency order, iterating cyclic components in place until a pass changes nothing, returning the number of range applications """
+        self.applications = 0
+        for (component, cyclic) in zip(self.components, self.cyclic):
+            if not cyclic:
+                self.plan.apply_range(image, component[0])
+                self.applications += 1
+                continue
+            for _ in xrange(max_passes):
+                changed = 0
+                for range_num in component:
+                    changed += self.plan.apply_range(image, range_num)
+                self.applications += len(component)
+                if changed == 0:
+                    break
+        return self.applications
+
+
+def required_sweeps(factor, error_bound, initial_error):
+    """ return how many passes shrinking an error by factor each take to bring initial_error within error_bound, or None if it never happens """
+    if initial_error <= error_bound:
+        return 0
+    if factor <= 0:
+        return 1
+    if factor >= 1:
+        return None
+    return int(math.ceil(math.log(float(error_bound) / initial_error) / math.log(factor)))
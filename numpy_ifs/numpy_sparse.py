@@ -0,0 +1,179 @@
+""" sparse linear decoding functionality of ifs """
+import numpy
+
+FIXED_POINT_METHODS = ('jacobi', 'gauss-seidel', 'anderson')
+
+
+class MalformedSparseMatrixError(Exception):
+    """ error class for IFSSparseMatrix """
+
+    def __str__(self):
+        return "Malformed sparse matrix!"
+
+
+class UnknownFixedPointMethodError(Exception):
+    """ error class for IFSFixedPointSolver """
+
+    def __str__(self):
+        return "Unknown fixed point method!"
+
+
+class IFSSparseMatrix(object):
+    """ compressed sparse row matrix held in numpy arrays """
+
+    def __init__(self, shape, values, columns, row_starts):
+        if len(row_starts) != shape[0] + 1 or len(values) != len(columns) or row_starts[-1] != len(values):
+            raise MalformedSparseMatrixError
+        self.shape = shape
+        self.values = values
+        self.columns = columns
+        self.row_starts = row_starts
+        # the row of every stored value, so that rows can be summed with one bincount
+        self.rows = numpy.repeat(numpy.arange(shape[0]), numpy.diff(row_starts))
+
+    @classmethod
+    def from_rows(cls, columns, values, num_columns=None):
+        """ build a matrix with the same number of values in every row, from (rows, values per row) arrays """
+        (num_rows, row_length) = columns.shape
+        if num_columns is None:
+            num_columns = num_rows
+        return cls((num_rows, num_columns), values.reshape(-1).astype(numpy.float64), columns.reshape(-1),
+                   numpy.arange(num_rows + 1) * row_length)
+
+    def dot(self, vector, start=0, stop=None):
+        """ multiply rows start:stop of the matrix by a vector """
+        if stop is None:
+            stop = self.shape[0]
+        first = self.row_starts[start]
+        last = self.row_starts[stop]
+        products = self.values[first:last] * vector[self.columns[first:last]]
+        return numpy.bincount(self.rows[first:last] - start, weights=products, minlength=stop - start)
+
+    def abs_row_sums(self):
+        """ return the sum of the absolute values in each row, whose largest is the infinity norm """
+        return numpy.bincount(self.rows, weights=numpy.absolute(self.values), minlength=self.shape[0])
+
+
+def build_ifs_operator(plan):
+    """ return the (matrix, offsets) of the affine map x -> matrix x + offsets that one sweep of a decode plan applies """
+    # unknowns are ordered as the plan writes them, range by range, so that every range is a contiguous run of rows
+    positions = numpy.empty(len(plan.destinations), dtype=numpy.intp)
+    positions[plan.destinations] = numpy.arange(len(plan.destinations))
+    weights = (plan.contrasts / float(plan.sources.shape[1]))[:, numpy.newaxis]
+    matrix = IFSSparseMatrix.from_rows(positions[plan.sources], numpy.repeat(weights, plan.sources.shape[1], 1))
+    return (matrix, plan.brightnesses.copy())
+
+
+def contraction_bound(matrix, iterations=32):
+    """ estimate from above the factor that errors eventually shrink by each sweep, the spectral radius of |matrix| """
+    # for any positive weights, the largest ratio of |matrix| weights to weights bounds the spectral radius,
+    # and power iteration moves the weights towards the ones giving the tightest bound
+    abs_matrix = IFSSparseMatrix(matrix.shape, numpy.absolute(matrix.values), matrix.columns, matrix.row_starts)
+    weights = numpy.ones(matrix.shape[0])
+    bound = None
+    for _ in xrange(iterations):
+        mapped = abs_matrix.dot(weights)
+        ratio = float((mapped / weights).max())
+        bound = ratio if bound is None else min(bound, ratio)
+        if mapped.max() == 0:
+            break
+        weights = numpy.maximum(mapped / mapped.max(), 1e-9)
+    return bound
+
+
+def initial_error_bound(matrix, offsets, x):
+    """ bound the largest difference between x and the fixed point of x -> matrix x + offsets, from the size of its first step """
+    # every step shrinks the largest difference by at least the infinity norm, so the steps after the first sum to at most
+    # a geometric series in it; the spectral radius is smaller but only describes how errors shrink in the long run
+    norm = float(matrix.abs_row_sums().max())
+    if norm >= 1:
+        return None
+    return float(numpy.absolute(matrix.dot(x) + offsets - x).max()) / (1.0 - norm)
+
+
+class IFSFixedPointSolver(object):
+    """ finds the attractor of a set of ifs codes by iterating its sparse affine map in floating point """
+
+    def __init__(self, plan, method='jacobi', tolerance=0.5, history=5):
+        if method not in FIXED_POINT_METHODS:
+            raise UnknownFixedPointMethodError
+        self.plan = plan
+        self.method = method
+        self.tolerance = tolerance
+        self.history = history
+        (self.matrix, self.offsets) = build_ifs_operator(plan)
+        self.x = None
+        self.iterations = 0
+        self.residual = None
+        self.differences = []
+
+    def start(self, image):
+        """ start iterating from the pixels of an image """
+        self.x = image.data.reshape(image.length)[self.plan.destinations].astype(numpy.float64)
+        self.iterations = 0
+        self.residual = None
+        self.differences = []
+
+    def apply_map(self, x):
+        """ return the affine map applied to x """
+        return self.matrix.dot(x) + self.offsets
+
+    def step_jacobi(self):
+        """ update every pixel from the previous iterate """
+        new_x = self.apply_map(self.x)
+        residual = numpy.absolute(new_x - self.x).max()
+        self.x = new_x
+        return residual
+
+    def step_gauss_seidel(self):
+        """ update range by range, each range reading the ranges already updated in this sweep """
+        residual = 0.0
+        range_starts = self.plan.range_starts.tolist()
+        for (start, stop) in zip(range_starts, range_starts[1:]):
+            new_values = self.matrix.dot(self.x, start, stop) + self.offsets[start:stop]
+            residual = max(residual, numpy.absolute(new_values - self.x[start:stop]).max())
+            self.x[start:stop] = new_values
+        return residual
+
+    def step_anderson(self):
+        """ take the combination of recent map outputs whose residual is least in the least squares sense """
+        mapped = self.apply_map(self.x)
+        difference = mapped - self.x
+        residual = numpy.absolute(difference).max()
+        self.differences.append((mapped, difference))
+        self.differences = self.differences[-(self.history + 1):]
+        if len(self.differences) > 1:
+            mapped_steps = numpy.array([later[0] - earlier[0] for (earlier, later) in zip(self.differences, self.differences[1:])]).T
+            difference_steps = numpy.array([later[1] - earlier[1] for (earlier, later) in zip(self.differences, self.differences[1:])]).T
+            weights = numpy.linalg.lstsq(difference_steps, difference, rcond=None)[0]
+            self.x = mapped - mapped_steps.dot(weights)
+        else:
+            self.x = mapped
+        return residual
+
+    def step(self):
+        """ take one iteration of the chosen method, returning the largest change it made to a pixel """
+        if self.method == 'jacobi':
+            residual = self.step_jacobi()
+        elif self.method == 'gauss-seidel':
+            residual = self.step_gauss_seidel()
+        else:
+            residual = self.step_anderson()
+        self.iterations += 1
+        self.residual = float(residual)
+        return self.residual
+
+    def solve(self, image, max_iterations):
+        """ iterate from the image until no pixel moves by more than the tolerance, yielding the largest change of each iteration """
+        self.start(image)
+        for _ in xrange(max_iterations):
+            residual = self.step()
+            yield residual
+            if residual <= self.tolerance:
+                break
+
+    def write(self, image):
+        """ write the current iterate into an image, rounded to whole values """
+        flat_data = image.data.reshape(image.length)
+        flat_data[self.plan.destinations] = numpy.rint(self.x)
+        image.invalidate_tables()
@@ -14,37 +14,12 @@ class InvalidFileFormatError(Exception):
         return "Invalid file format!"
 
 
-def read_pgm(filename):
-    """ read pgm data from a file """
-    with open(filename, 'r') as image_file:
-        line_count = 0
-        data = []
-        try:
-            for line in image_file:
-                line = line.rstrip('\n')
-                if line_count == 0:
-                    if line != "P2":
-                        raise InvalidFileFormatError
-                elif line_count == 1:
-                    pass
-                elif line_count == 2:
-                    (width, height) = line.split()
-                elif line_count == 3:
-                    whiteval = line
-                else:
-                    for val in line.split():
-                        data.append(val)
-                line_count += 1
-	except ValueError as ve:
-            print "Error encountered with the following line!"
-            print line
-            print ve
-            raise ve
-        return (width, height, whiteval, data)
-
-
 def read_ifs(filename):
     """ read ifs data from a file """
+    if numpy_ifs.is_binary_ifs(filename):
+        return numpy_ifs.read_binary_ifs(filename)
+    if numpy_ifs.is_archived_ifs(filename):
+        return numpy_ifs.read_archived_ifs(filename)
     width = None
     height = None
     range_size = None
@@ -84,8 +59,16 @@ def read_ifs(filename):
     return (width, height, range_size, domain_size, whiteval, data)
 
 
-def write_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data):
+def write_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data, options=None):
     """ write encoded ifs data to a file """
+    if options is not None and options.archive:
+        numpy_ifs.write_archived_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data,
+                                     options.contrast_bits, options.brightness_bits, options.max_contrast)
+        return
+    if options is not None and options.binary:
+        numpy_ifs.write_binary_ifs(filename, width, height, whiteval, range_size, domain_size, ifs_data,
+                                   options.contrast_bits, options.brightness_bits, options.max_contrast)
+        return
     with open(filename, 'w') as ifs_file:
         ifs_file.write("#IFS\n")
         ifs_file.write(str(width) + " " + str(height) + " " +
@@ -104,15 +87,72 @@ def main():
     parser.add_option('-f', '--file', action='store', type='string', help='the pgm file you wish to encode')
     parser.add_option('-r', '--rangesize', action='store', type='int', default=4, help='the required rangesize')
     parser.add_option('-d', '--domainsize', action='store', type='int', default=8, help='the required domainsize')
-    parser.add_option('-i', '--iterations', action='store', type='int', default=None, help='the number of times to apply ifs during decoding')
+    parser.add_option('-i', '--iterations', action='store', type='int', default=None,
+                      help='the number of times to apply ifs during decoding, or of passes with the other decoders (default: estimated from the contrasts)')
     parser.add_option('-p', '--print_intervals', action='store', type='int', default=0, help='the number of times to print interim versions of the generated image')
     parser.add_option('-v', '--verbose', action='store', type='int', default=0, help='verbosity level')
     parser.add_option('-z', '--zoom', action='store', type='int', default=1, help='fractal zoom level')
+    parser.add_option('-s', '--search', action='store', type='choice', choices=['full', 'batch', 'classified', 'nearest', 'fft', 'coarse', 'local'], default='full',
+                      help='domain search: full (per domain, early exit), batch (whole domain pool at once), '
+                           'classified (domains of the quadrant class of the range or of its negation), '
+                           'nearest (k-d tree of normalised domains), fft (whole domain pool by fft correlation), '
+                           'coarse (domains on the domain-step lattice, then every domain near the best k of them) '
+                           'or local (per domain in rings outwards from the range, early exit)')
+    parser.add_option('-k', '--candidates', action='store', type='int', default=8,
+                      help='the number of nearest domains to fit exactly when searching nearest, or of domains to refine around when searching coarse or by pyramid')
+    parser.add_option('--search-radius', action='store', type='int', default=None,
+                      help='how many domain positions either way a local search may go from the range (at least domain-step - 1; default: the whole image)')
+    parser.add_option('--fit-threshold', action='store', type='float', default=1.0,
+                      help='mean absolute error per pixel at which full and local searches stop at the fit found')
+    parser.add_option('--canonical', action='store_true', default=False,
+                      help='turn ranges and domains to a canonical orientation so the full, local and batch searches compare each pair once, not under all eight transforms')
+    parser.add_option('--domain-step', action='store', type='int', default=1,
+                      help='spacing of the lattice of domain positions searched, which trades quality for encoding time (not used by fft)')
+    parser.add_option('-w', '--workers', action='store', type='int', default=1, help='the number of processes to encode ranges with')
+    parser.add_option('--decoder', action='store', type='choice', choices=['random', 'sweep', 'schedule'] + list(numpy_ifs.FIXED_POINT_METHODS), default='random',
+                      help='decoding: random (one random range at a time), sweep (every range at once, until the image stops changing), '
+                           'schedule (ranges in dependency order, iterating only where ranges depend on each other in a cycle), '
+                           'or jacobi, gauss-seidel or anderson (iterating the sparse linear map of the codes in floating point)')
+    parser.add_option('--cache-plan', action='store_true', default=False,
+                      help='keep the compiled decode plan next to the ifs file, so decoding the same file again skips compiling it (the plan is much larger than the codes)')
+    parser.add_option('--tolerance', action='store', type='float', default=0.5,
+                      help='the change between checks at which decoding stops: the largest or rms change to a pixel, or the smallest psnr in db')
+    parser.add_option('--error-bound', action='store', type='float', default=0.5,
+                      help='the distance from the attractor that the default number of decoding iterations is estimated to reach')
+    parser.add_option('--clamp-contrast', action='store', type='float', default=None,
+                      help='limit every contrast to this magnitude before decoding, so codes with contrasts of 1 or more still converge')
+    parser.add_option('--convergence-metric', action='store', type='choice', choices=list(numpy_ifs.CONVERGENCE_METRICS), default='max',
+                      help='how the random and sweep decoders measure change between checks: max, rms or psnr')
+    parser.add_option('--decimate', action='store_true', default=False, help='shrink domains by averaging the image down once instead of resizing every domain')
+    parser.add_option('-b', '--binary', action='store_true', default=False, help='write the ifs file in the packed binary format')
+    parser.add_option('--binary-pgm', action='store_true', default=False, help='write reconstructed images as binary (P5) pgm files')
+    parser.add_option('-a', '--archive', action='store_true', default=False, help='write the ifs file in the entropy coded archival format')
+    parser.add_option('--contrast-bits', action='store', type='int', default=5, help='bits per contrast in the binary and archival formats')
+    parser.add_option('--brightness-bits', action='store', type='int', default=8, help='bits per brightness in the binary and archival formats')
+    parser.add_option('--pyramid-levels', action='store', type='int', default=0,
+                      help='compare ranges with every domain of the image this many times halved, then with the domains near the best k '
+                           'at each finer level (replaces --search)')
+    parser.add_option('--pyramid-radius', action='store', type='int', default=2,
+                      help='how many domain positions either way the pyramid refines around the position found at the level above')
+    parser.add_option('-q', '--quadtree', action='store_true', default=False,
+                      help='split ranges of rangesize into quarters, down to min-rangesize, wherever no domain fits them well enough')
+    parser.add_option('--min-rangesize', action='store', type='int', default=2, help='the smallest range size the quadtree splits down to')
+    parser.add_option('--split-threshold', action='store', type='float', default=8.0,
+                      help='rms collage error in grey levels above which a quadtree range is split')
+    parser.add_option('--flat-threshold', action='store', type='float', default=None,
+                      help='give ranges whose standard deviation in grey levels is at most this a flat code of their mean, without searching domains')
+    parser.add_option('--max-contrast', action='store', type='float', default=0.9,
+                      help='largest contrast magnitude the encoder fits, which keeps decoding contractive while it is below 1')
     options, _ = parser.parse_args()
     in_file = "input/" + options.file
     range_size = options.rangesize
     domain_size = options.domainsize
-    ifs_file = "encoded_files/" + in_file.replace("input/", "").replace(".pgm", "") + "_r" + str(range_size) + "_d" + str(domain_size) + ".ifs"
+    if options.quadtree:
+        # quadtree domains are always twice the size of their ranges
+        domain_size = 2 * range_size
+        ifs_file = "encoded_files/" + in_file.replace("input/", "").replace(".pgm", "") + "_q" + str(range_size) + "_" + str(options.min_rangesize) + ".ifs"
+    else:
+        ifs_file = "encoded_files/" + in_file.replace("input/", "").replace(".pgm", "") + "_r" + str(range_size) + "_d" + str(domain_size) + ".ifs"
     out_file = "output/" + ifs_file.replace("encoded_files/", "").replace(".ifs", ".pgm")
     verbosity = options.verbose
 
@@ -122,66 +162,79 @@ def main():
     print "domain size " + str(domain_size)
 
     created_ifs = False
+    quadtree_leaves = None
 
-    if not os.path.exists(ifs_file):
+    if options.quadtree and not os.path.exists(ifs_file):
+        print "ifs not present - creating quadtree ifs file from scratch"
+        created_ifs = True
+        print "opening image " + in_file
+        (width, height, whiteval, data) = numpy_ifs.read_pgm(in_file)
+        print "done"
+        print "image width: " + str(width)
+        print "image height: " + str(height)
+        if options.binary or options.archive:
+            print "quadtree codes are only written in the text format"
+        quantiser = numpy_ifs.IFSQuantiser(whiteval, max_contrast=options.max_contrast)
+        encoder = numpy_ifs.IFSQuadtreeEncoder(width, whiteval, data, range_size, options.min_rangesize, options.split_threshold, options.search,
+                                               options.decimate, verbosity, options.candidates, quantiser, options.flat_threshold,
+                                               options.domain_step, options.canonical)
+        print "splitting ranges from " + str(range_size) + " down to " + str(options.min_rangesize) + " while their rms error is above " + str(options.split_threshold)
+        quadtree_leaves = list(encoder.encode())
+        print "finished calculations"
+        sizes = [leaf[2] for leaf in quadtree_leaves]
+        print ("encoded " + str(len(quadtree_leaves)) + " ranges (" +
+               ", ".join(str(sizes.count(size)) + " of size " + str(size) for size in encoder.sizes) + "), " +
+               str(encoder.warm_starts) + " fitted by their parent's domain, " +
+               str(sum(1 for leaf in quadtree_leaves if leaf[3] == numpy_ifs.FLAT_DOMAIN)) + " flat")
+        numpy_ifs.write_quadtree_ifs(ifs_file, width, height, whiteval, range_size, options.min_rangesize, quadtree_leaves)
+    elif not os.path.exists(ifs_file):
         current_range = 0
+        ifs_start = 0
         ifs_array = []
         if os.path.exists(ifs_file + ".part"):
             (width, height, range_size, domain_size, whiteval, ifs_array) = read_ifs(ifs_file + ".part")
+            ifs_array = list(ifs_array)
             nranges = (width / range_size) * (height / range_size)
             current_range = len(ifs_array)
+            ifs_start = current_range
             print "ifs file part present - continuing from " + str(current_range) + "/" + str(nranges)
         else:
             print "ifs not present - creating ifs file from scratch"
         created_ifs = True
         print "opening image " + in_file
-        (width, height, whiteval, data) = read_pgm(in_file)
+        (width, height, whiteval, data) = numpy_ifs.read_pgm(in_file)
         print "done"
-        width = int(width)
         print "image width: " + str(width)
-        height = int(height)
         print "image height: " + str(height)
-        whiteval = int(whiteval)
-        data = [int(val) for val in data]
-        fit_threshold = float(range_size*range_size) * 1
         image = numpy_ifs.IFSImage(width, whiteval, range_size, domain_size, data)
-        resized_domain_array = [None] * image.num_domains
+        if options.search not in ('full', 'local') and options.pyramid_levels == 0:
+            print "building " + options.search + " domain pool"
+        if options.binary or options.archive:
+            # codes are fitted to the quantised values the file will actually store
+            quantiser = numpy_ifs.IFSQuantiser(whiteval, options.contrast_bits, options.brightness_bits, options.max_contrast)
+        else:
+            quantiser = numpy_ifs.IFSQuantiser(whiteval, max_contrast=options.max_contrast)
+        if options.pyramid_levels > 0:
+            print ("searching " + str(options.pyramid_levels) + " levels down a pyramid, refining within " + str(options.pyramid_radius) +
+                   " positions of the best " + str(options.candidates) + " domains at each level")
+            encoder = numpy_ifs.IFSPyramidEncoder(image, options.pyramid_levels, options.pyramid_radius, options.candidates, options.decimate,
+                                                  quantiser, options.flat_threshold, options.domain_step)
+        else:
+            encoder = numpy_ifs.IFSEncoder(image, options.search, options.decimate, options.workers > 1, verbosity, options.candidates, quantiser,
+                                           options.flat_threshold, options.domain_step, options.search_radius, options.fit_threshold,
+                                           options.canonical)
         pgm_part_write = 1
 
         print "calculating best ifs transform for each range"
+        if options.workers > 1:
+            print "encoding with " + str(options.workers) + " worker processes"
+            results = numpy_ifs.encode_ranges_in_parallel(encoder, current_range, options.workers)
+        else:
+            results = encoder.encode_ranges(current_range)
         calc_time = 0
-        for irange in image.get_ranges(current_range):
+        start = time()
+        for (best_domain, best_transform, best_contrast, best_brightness, best_fit) in results:
             print "range: {}/{}".format(current_range, image.num_ranges)
-            if current_range < 10:
-                start = time()
-            best_domain = None
-            best_transform = None
-            best_contrast = None
-            best_brightness = None
-            best_fit = 9999999999
-            domain_num = 0
-            for domain in image.get_domains():
-                if resized_domain_array[domain_num] is None:
-                    resized_domain_array[domain_num] = domain.resize(range_size)
-                (transform, contrast, brightness, fit) = numpy_ifs.find_best_transform(irange, resized_domain_array[domain_num])
-                if fit < best_fit:
-                    # print "range: {}, domain: {}/{}".format(current_range, domain_num, image.num_domains)
-                    best_fit = fit
-                    best_domain = domain_num
-                    best_transform = transform
-                    best_contrast = contrast
-                    best_brightness = brightness
-                    # print "fit: {} threshold: {}".format(fit, fit_threshold)
-                if fit <= fit_threshold:
-                    break
-                if verbosity > 1:
-                    if domain_num % (image.num_domains / 100) == 0:
-                        print("  done domain " + str(domain_num) +
-                              " / " + str(image.num_domains) +
-                              " (" + str((100 * domain_num) / image.num_domains) +
-                              "% of range " + str(current_range + 1) +
-                              " of " + str(image.num_ranges) + ")")
-                domain_num += 1
             if verbosity > 0:
                 if current_range % 1000 == 0:
                     print "done range " + str(current_range) + " (" + str(current_range + 1) + " of " + str(image.num_ranges) + ")"
@@ -189,6 +242,7 @@ def main():
             if current_range < 10:
                 elapsed = time() - start
                 calc_time += elapsed
+                start = time()
             current_range += 1
             if current_range == 10:
                 print "first 10 calculations took {} seconds".format(calc_time)
@@ -203,24 +257,47 @@ def main():
                 elif 1 / calc_time > 0.2:
                     pgm_part_write = 12
             if current_range % pgm_part_write == 0:
-                write_ifs(ifs_file + ".part", width, height, whiteval, range_size, domain_size, ifs_array)
+                write_ifs(ifs_file + ".part", width, height, whiteval, range_size, domain_size, ifs_array, options)
 
         print "finished calculations"
+        if options.search in ('full', 'local') and options.pyramid_levels == 0:
+            print "search pruning: " + str(encoder.stats)
+            # canonical searches try one transform of each domain rather than all eight
+            orientations = 1 if encoder.canonical else 8
+            print ("compared " + str(encoder.stats.candidates / orientations) + " domains, {:.2f}% of every range against every domain".format(
+                100.0 * encoder.stats.candidates / (float(orientations) * image.num_domains * max(image.num_ranges - ifs_start, 1))))
+        if options.flat_threshold is not None:
+            print str(sum(1 for an_ifs in ifs_array if numpy_ifs.is_flat_code(an_ifs))) + " flat ranges encoded without a search"
 
-        write_ifs(ifs_file, width, height, whiteval, range_size, domain_size, ifs_array)
+        write_ifs(ifs_file, width, height, whiteval, range_size, domain_size, ifs_array, options)
         os.remove(ifs_file + ".part")
+    elif numpy_ifs.is_quadtree_ifs(ifs_file):
+        print "ifs present, opening quadtree ifs file"
+        (width, height, range_size, _, whiteval, quadtree_leaves) = numpy_ifs.read_quadtree_ifs(ifs_file)
     else:
         print "ifs present, opening ifs file"
         (width, height, range_size, domain_size, whiteval, ifs_array) = read_ifs(ifs_file)
 
-    if options.zoom != 1:
+    if quadtree_leaves is not None:
+        # the decode image is divided into the smallest ranges, which every quadtree range is made of
+        range_size = min(leaf[2] for leaf in quadtree_leaves)
+        domain_size = 2 * range_size
+        if options.zoom != 1:
+            print "zoom is not supported for quadtree codes, decoding at the original size"
+        if options.decoder == 'random':
+            print "random decoding needs uniform ranges, decoding quadtree codes by sweeps"
+            options.decoder = 'sweep'
+    elif options.zoom != 1:
         width = options.zoom * width
         height = options.zoom * height
         range_size = options.zoom * range_size
         domain_size = options.zoom * domain_size
         zoomed_ifs_array = []
         for an_ifs in ifs_array:
-            zoomed_ifs_array.append((an_ifs[0] * options.zoom, an_ifs[1], an_ifs[2], an_ifs[3]))
+            if numpy_ifs.is_flat_code(an_ifs):
+                zoomed_ifs_array.append(an_ifs)
+            else:
+                zoomed_ifs_array.append((an_ifs[0] * options.zoom, an_ifs[1], an_ifs[2], an_ifs[3]))
         ifs_array = zoomed_ifs_array
         out_file = out_file.replace(".pgm", "_z" + str(options.zoom) + ".pgm")
 
@@ -230,9 +307,43 @@ def main():
     seed_data = [128] * width * height
     working_image = numpy_ifs.IFSImage(width, whiteval, range_size, domain_size, seed_data)
 
-    order_of_convergence_iterations = 16 * (width / range_size) * (width / range_size)
+    # the compiled plan is only kept next to the ifs file when asked for, since it is many times the size of the codes
+    plan_file = ifs_file + ".plan.npz" if options.cache_plan else None
+    if quadtree_leaves is not None:
+        plan = numpy_ifs.load_or_compile_plan(working_image, quadtree_leaves, plan_file, ifs_file, numpy_ifs.compile_quadtree_plan)
+    else:
+        plan = numpy_ifs.load_or_compile_plan(working_image, ifs_array, plan_file, ifs_file)
+    if options.clamp_contrast is not None:
+        plan.clamp_contrasts(options.clamp_contrast)
+    schedule = numpy_ifs.IFSDecodeSchedule(plan)
+
+    # the starting error is bounded using the largest contrast, errors eventually shrink by the contraction factor with
+    # every pass round a cycle, and values then take at most the depth of the dependency graph in sweeps to pass down to every range
+    (operator, offsets) = numpy_ifs.build_ifs_operator(plan)
+    contraction_factor = numpy_ifs.contraction_bound(operator)
+    largest_contrast = schedule.largest_cyclic_contrast()
+    seed_error = numpy_ifs.initial_error_bound(operator, offsets, working_image.data.reshape(-1)[plan.destinations].astype(float))
+    cyclic_passes = None
+    if seed_error is not None:
+        cyclic_passes = numpy_ifs.required_sweeps(contraction_factor, options.error_bound, seed_error)
+    print ("contraction factor " + str(contraction_factor) + " (largest contrast in a cycle " + str(largest_contrast) +
+           "), dependency depth " + str(schedule.depth()))
+    if largest_contrast >= 1:
+        print "warning: contrasts of magnitude 1 or more in a cycle of ranges make the codes non-contractive in places (see --clamp-contrast)"
+    if cyclic_passes is None:
+        if contraction_factor >= 1:
+            print "warning: errors do not shrink as the codes are iterated, so decoding will not converge (see --clamp-contrast)"
+        else:
+            print "warning: contrasts of magnitude 1 or more leave the starting error unbounded, so the number of sweeps is not estimated (see --clamp-contrast)"
+        cyclic_passes = 64
+        num_sweeps = 64
+    else:
+        num_sweeps = cyclic_passes + schedule.depth()
+        print "estimated " + str(num_sweeps) + " sweeps to come within " + str(options.error_bound) + " of the attractor"
+
     if options.iterations is None:
-        num_ifs_to_apply = order_of_convergence_iterations * 4
+        # random applications reach every range about as often as sweeps do, with a full range scan forced every num_ranges
+        num_ifs_to_apply = num_sweeps * plan.num_ranges
     else:
         num_ifs_to_apply = options.iterations
 
@@ -241,60 +352,85 @@ def main():
         if not os.path.isdir(temp_file_dir):
             os.mkdir(temp_file_dir)
 
-    test_sample_interval = working_image.num_ranges / 4
-    force_range_scan_interval = working_image.num_ranges
-    print "testing for convergence every " + str(test_sample_interval) + " ifs applied"
-    print "forcing full range scan every " + str(force_range_scan_interval) + " ifs applied"
-    test_image_data = working_image.data.copy()
-    actual_ifs_applied_count = 0
-    num_full_range_scan = 0
-    for i in range(num_ifs_to_apply):
-        range_num = random.randrange(len(ifs_array))
-        if options.print_intervals != 0 and actual_ifs_applied_count % options.print_intervals == 0:
-            temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_i" + str(actual_ifs_applied_count) + ".pgm"
-            working_image.write_pgm(temp_out_file)
-        actual_ifs_applied_count += 1
-        working_image.apply_ifs(range_num, ifs_array[range_num])
-        if i != 0 and i % force_range_scan_interval == 0:
-            # do full range scan
-            num_full_range_scan += 1
-            for (rnum, an_ifs) in enumerate(ifs_array):
-                working_image.apply_ifs(rnum, an_ifs)
-                actual_ifs_applied_count += 1
-                if rnum != 0 and options.print_intervals != 0:
-                    if actual_ifs_applied_count % options.print_intervals == 0:
-                        temp_out_file = (temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") +
-                                         "_i" + str(actual_ifs_applied_count) + "_f" +
-                                         str(num_full_range_scan) + ".pgm")
-                        working_image.write_pgm(temp_out_file)
-        if (actual_ifs_applied_count + 1) % test_sample_interval == 0:
-            match = True
-            for j in range(working_image.data.size):
-                if working_image.data.item(j) != test_image_data.item(j):
-                    match = False
-                    break
-            if match:
-                print "IFS appears to have converged, doing one full range scan"
+    monitor = numpy_ifs.IFSConvergenceMonitor(working_image.data, whiteval, options.convergence_metric, options.tolerance)
+    if options.decoder == 'sweep':
+        decoder = numpy_ifs.IFSDecoder(working_image, plan=plan)
+        max_sweeps = num_sweeps if options.iterations is None else options.iterations
+        print "decoding by up to " + str(max_sweeps) + " full sweeps of every range"
+        for (sweep_num, changed) in enumerate(decoder.decode(max_sweeps)):
+            if options.print_intervals != 0 and sweep_num % options.print_intervals == 0:
+                temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_s" + str(sweep_num) + ".pgm"
+                working_image.write_pgm(temp_out_file, options.binary_pgm)
+            converged = monitor.check(working_image.data)
+            if verbosity > 0:
+                print "sweep " + str(sweep_num) + ": " + str(changed) + " pixels changed, " + str(monitor)
+            if converged:
+                print "Exiting loop as ifs has converged after " + str(sweep_num + 1) + " sweeps"
+                break
+    elif options.decoder == 'schedule':
+        # one more pass than the estimate confirms that nothing changes
+        max_passes = cyclic_passes + 1 if options.iterations is None else options.iterations
+        print ("scheduled " + str(plan.num_ranges) + " ranges: " + str(plan.num_ranges - schedule.num_cyclic_ranges()) +
+               " applied once, " + str(schedule.num_cyclic_ranges()) + " in " + str(schedule.num_cycles()) + " cycles iterated up to " + str(max_passes) + " passes")
+        applications = schedule.decode(working_image, max_passes)
+        print "decoded with " + str(applications) + " range applications"
+    elif options.decoder in numpy_ifs.FIXED_POINT_METHODS:
+        solver = numpy_ifs.IFSFixedPointSolver(plan, options.decoder, options.tolerance)
+        max_iterations = num_sweeps if options.iterations is None else options.iterations
+        print "solving for the attractor by up to " + str(max_iterations) + " " + options.decoder + " iterations"
+        for (iteration, residual) in enumerate(solver.solve(working_image, max_iterations)):
+            if options.print_intervals != 0 and iteration % options.print_intervals == 0:
+                solver.write(working_image)
+                temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_s" + str(iteration) + ".pgm"
+                working_image.write_pgm(temp_out_file, options.binary_pgm)
+            if verbosity > 0:
+                print "iteration " + str(iteration) + ": largest change " + str(residual)
+        solver.write(working_image)
+        if solver.residual <= options.tolerance:
+            print "Exiting loop as ifs has converged to within " + str(options.tolerance) + " after " + str(solver.iterations) + " iterations"
+    else:
+        test_sample_interval = working_image.num_ranges / 4
+        force_range_scan_interval = working_image.num_ranges
+        print "testing for convergence every " + str(test_sample_interval) + " ifs applied"
+        print "forcing full range scan every " + str(force_range_scan_interval) + " ifs applied"
+        actual_ifs_applied_count = 0
+        num_full_range_scan = 0
+        for i in range(num_ifs_to_apply):
+            range_num = random.randrange(len(ifs_array))
+            if options.print_intervals != 0 and actual_ifs_applied_count % options.print_intervals == 0:
+                temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_i" + str(actual_ifs_applied_count) + ".pgm"
+                working_image.write_pgm(temp_out_file, options.binary_pgm)
+            actual_ifs_applied_count += 1
+            working_image.apply_ifs(range_num, ifs_array[range_num])
+            if i != 0 and i % force_range_scan_interval == 0:
+                # do full range scan
+                num_full_range_scan += 1
                 for (rnum, an_ifs) in enumerate(ifs_array):
                     working_image.apply_ifs(rnum, an_ifs)
                     actual_ifs_applied_count += 1
-                for k in range(len(working_image.data)):
-                    if working_image.data.item(k) != test_image_data.item(k):
-                        print "   it hadn't converged"
-                        test_image_data = working_image.data.copy()
-                        match = False
+                    if rnum != 0 and options.print_intervals != 0:
+                        if actual_ifs_applied_count % options.print_intervals == 0:
+                            temp_out_file = (temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") +
+                                             "_i" + str(actual_ifs_applied_count) + "_f" +
+                                             str(num_full_range_scan) + ".pgm")
+                            working_image.write_pgm(temp_out_file, options.binary_pgm)
+            if (actual_ifs_applied_count + 1) % test_sample_interval == 0:
+                if monitor.check(working_image.data):
+                    print "IFS appears to have converged (" + str(monitor) + "), doing one full range scan"
+                    for (rnum, an_ifs) in enumerate(ifs_array):
+                        working_image.apply_ifs(rnum, an_ifs)
+                        actual_ifs_applied_count += 1
+                    if monitor.check(working_image.data):
+                        print "Exiting loop as ifs has converged"
+                        if options.print_intervals != 0:
+                            temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_i" + str(actual_ifs_applied_count) + ".pgm"
+                            working_image.write_pgm(temp_out_file, options.binary_pgm)
                         break
-                if match:
-                    print "Exiting loop as ifs has converged"
-                    temp_out_file = temp_file_dir + "/" + out_file.replace("output/", "").replace(".pgm", "") + "_i" + str(actual_ifs_applied_count) + ".pgm"
-                    working_image.write_pgm(temp_out_file)
-                    break
-            else:
-                test_image_data = working_image.data.copy()
+                    print "   it hadn't converged (" + str(monitor) + ")"
 
     finished_operations_time = datetime.datetime.now()
 
-    working_image.write_pgm(out_file)
+    working_image.write_pgm(out_file, options.binary_pgm)
 
     print "completed reconstructing image at " + str(finished_operations_time)
 